@@ -0,0 +1,147 @@
+import heapq
+import threading
+import numpy as np
+from scoring import VectorIndex, normalize, top_k_indices
+
+MIN_TRAIN_SIZE = 1000 #below this many vectors a single list is kept -> search is exact and nothing is trained
+RETRAIN_FACTOR = 2 #centroids are retrained once the index has grown to this multiple of the size it was trained on
+TRAIN_SAMPLES_PER_LIST = 64 #k-means runs on a sample of this many vectors per list instead of the whole catalog
+TRAIN_ITERATIONS = 8
+
+
+#spherical k-means on unit vectors -> returns a (n_lists, dim) matrix of unit-length centroids
+def train_centroids(vectors: np.ndarray, n_lists: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    if len(vectors) > TRAIN_SAMPLES_PER_LIST * n_lists:
+        vectors = vectors[rng.choice(len(vectors), TRAIN_SAMPLES_PER_LIST * n_lists, replace=False)]
+
+    centroids = vectors[rng.choice(len(vectors), n_lists, replace=False)].copy()
+    for _ in range(TRAIN_ITERATIONS):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = np.bincount(assignment, minlength=n_lists) == 0
+        if empty.any(): #re-seed lists that lost all their vectors
+            sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+#index of the nearest centroid for each row, computed in chunks so the score matrix stays small
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 8192) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk_size):
+        assignment[start:start + chunk_size] = np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+    return assignment
+
+
+class IVFIndex: #approximate cosine search -> vectors are bucketed by nearest centroid and a query only scans the nprobe closest buckets
+    #same interface as scoring.VectorIndex, so the two can be swapped through config.RECOMMENDATION_SEARCH
+    def __init__(self, nprobe: int = 8):
+        self.lock = threading.RLock() #re-entrant because upsert can trigger a retrain, which rebuilds under the same lock
+        self.nprobe = nprobe
+        self.loaded = False
+        self.clear()
+
+    def __len__(self):
+        return len(self.assignment)
+
+    def __contains__(self, id):
+        return id in self.assignment
+
+    def clear(self):
+        self.centroids = None #None until the index holds MIN_TRAIN_SIZE vectors
+        self.lists = [VectorIndex()] #one exact index per centroid
+        self.assignment = {} #id -> position of its list in self.lists
+        self.trained_size = 0
+
+    #replaces the whole content of the index and retrains the centroids
+    def build(self, ids: list, vectors):
+        with self.lock:
+            self.clear()
+            if ids:
+                vectors = normalize(vectors)
+                if len(ids) >= MIN_TRAIN_SIZE:
+                    self.centroids = train_centroids(vectors, int(np.sqrt(len(ids))))
+                    assignment = assign_lists(vectors, self.centroids)
+                else:
+                    assignment = np.zeros(len(ids), dtype=np.int64)
+
+                self.lists = [VectorIndex() for _ in range(1 if self.centroids is None else len(self.centroids))]
+                for list_number, index in enumerate(self.lists):
+                    members = np.flatnonzero(assignment == list_number)
+                    index.build([ids[i] for i in members], vectors[members])
+                self.assignment = dict(zip(ids, assignment.tolist()))
+                self.trained_size = len(ids)
+            self.loaded = True
+
+    def nearest_list(self, vector: np.ndarray) -> int:
+        if self.centroids is None:
+            return 0
+        return int(np.argmax(self.centroids @ vector))
+
+    #adds a vector or moves an existing id to the list of its new nearest centroid
+    def upsert(self, id, vector):
+        vector = normalize(vector)
+        with self.lock:
+            list_number = self.nearest_list(vector)
+            previous = self.assignment.get(id)
+            if previous is not None and previous != list_number:
+                self.lists[previous].remove(id)
+            self.lists[list_number].upsert(id, vector)
+            self.assignment[id] = list_number
+
+            #centroids trained on a much smaller catalog make the lists unbalanced -> retrain as the catalog grows
+            if len(self.assignment) >= max(MIN_TRAIN_SIZE, RETRAIN_FACTOR * self.trained_size):
+                self.retrain()
+
+    def remove(self, id):
+        with self.lock:
+            list_number = self.assignment.pop(id, None)
+            if list_number is not None:
+                self.lists[list_number].remove(id)
+
+    def retrain(self):
+        with self.lock:
+            ids = [id for index in self.lists for id in index.ids]
+            vectors = np.concatenate([index.data[:index.size] for index in self.lists if index.size])
+            self.build(ids, vectors)
+
+    #returns up to k (id, score) pairs with the highest cosine similarity among the nprobe nearest lists, best first
+    #ids in exclude are never returned
+    def search(self, vector, k: int, exclude=()) -> list:
+        vector = normalize(vector)
+        with self.lock:
+            if self.centroids is None:
+                probes = [0]
+            else:
+                probes = top_k_indices(self.centroids @ vector, self.nprobe)
+            excluded = {} #list -> its excluded ids, so every list only checks its own
+            for id in exclude:
+                if id in self.assignment:
+                    excluded.setdefault(self.assignment[id], []).append(id)
+            results = []
+            for list_number in probes:
+                results.extend(self.lists[list_number].search(vector, k, exclude=excluded.get(list_number, ())))
+        return heapq.nlargest(k, results, key=lambda result: result[1])
+
+    #stored (normalized) vectors of the given ids, one row per id
+    def get_vectors(self, ids: list) -> np.ndarray:
+        with self.lock:
+            return np.array([self.lists[self.assignment[id]].get_vectors([id])[0] for id in ids], dtype=np.float32).reshape(len(ids), -1)
+
+    #scores only the given ids, each in its own list -> exact over the candidates, nprobe does not apply
+    def search_among(self, vector, k: int, ids: list) -> list:
+        vector = normalize(vector)
+        with self.lock:
+            by_list = {}
+            for id in ids:
+                if id in self.assignment:
+                    by_list.setdefault(self.assignment[id], []).append(id)
+            results = []
+            for list_number, list_ids in by_list.items():
+                results.extend(self.lists[list_number].search_among(vector, k, list_ids))
+        return heapq.nlargest(k, results, key=lambda result: result[1])
+
+    def search_many(self, vectors, k: int, exclude_rows: list = None) -> list:
+        exclude_rows = exclude_rows or [()] * len(vectors)
+        return [self.search(vector, k, exclude=row_exclude) for vector, row_exclude in zip(normalize(vectors), exclude_rows)]
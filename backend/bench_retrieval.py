@@ -0,0 +1,103 @@
+#benchmark of two-stage retrieval -> run from the backend directory with `python bench_retrieval.py`
+#compares full cosine scoring of every event against a BM25 candidate pool reranked by embedding, for several pool sizes
+#reports recall@k against full scoring and p50/p99 latency of both
+#by default builds a synthetic catalog where texts and vectors share topics, --from-db uses the stored events, embeddings and user profiles
+import argparse
+import time
+import numpy as np
+from scoring import VectorIndex
+from lexical_index import BM25Index
+
+
+#every topic has its own vocabulary and vector centre -> an event's words and vector both come from its topic plus noise,
+#so keyword overlap and embedding similarity agree often but not always, like real descriptions
+def synthetic_catalog(rng, size: int, queries: int, dim: int, topics: int, words_per_topic: int = 40, text_length: int = 60):
+    vocabulary = np.array([f'w{i}' for i in range(topics * words_per_topic)])
+    centres = rng.standard_normal((topics, dim), dtype=np.float32)
+
+    def sample(count):
+        topic = rng.integers(0, topics, count)
+        texts = []
+        for t in topic:
+            own = rng.integers(t * words_per_topic, (t + 1) * words_per_topic, text_length * 2 // 3)
+            other = rng.integers(0, len(vocabulary), text_length // 3)
+            texts.append(' '.join(vocabulary[np.concatenate([own, other])]))
+        return texts, centres[topic] + 0.8 * rng.standard_normal((count, dim), dtype=np.float32)
+
+    event_texts, event_vectors = sample(size)
+    query_texts, query_vectors = sample(queries)
+    return list(range(size)), event_texts, event_vectors, query_texts, query_vectors
+
+def load_db_catalog():
+    import models
+    from database import SessionLocal
+    from lexical_index import lexical_text
+    from embedding_store import profile_key, profile_text
+    db = SessionLocal()
+    try:
+        events = db.query(models.Event, models.EventEmbedding.embedding).join(models.EventEmbedding, models.EventEmbedding.event_id == models.Event.id).all()
+        users = db.query(models.User).all()
+        cached = dict(db.query(models.ProfileEmbedding.key, models.ProfileEmbedding.embedding).all())
+    finally:
+        db.close()
+    profiles = [(profile_text(user), cached[profile_key(profile_text(user))]) for user in users if profile_key(profile_text(user)) in cached]
+    return ([event.id for event, embedding in events], [lexical_text(event) for event, embedding in events], np.array([embedding for event, embedding in events], dtype=np.float32),
+            [text for text, embedding in profiles], np.array([embedding for text, embedding in profiles], dtype=np.float32))
+
+#runs search(i) for every query, returning the result ids and the latency of each query in milliseconds
+def run_queries(search, count: int):
+    results = []
+    latencies = []
+    for i in range(count):
+        start = time.perf_counter()
+        found = search(i)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([id for id, score in found])
+    return results, np.array(latencies)
+
+def recall(found: list, exact: list) -> float:
+    return float(np.mean([len(set(f) & set(e)) / len(e) for f, e in zip(found, exact) if e]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of BM25 prefilter + embedding rerank vs full scoring')
+    parser.add_argument('--size', type=int, default=50000, help='number of synthetic events')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--topics', type=int, default=200, help='number of topics in the synthetic catalog')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--candidates', type=int, nargs='+', default=[100, 500, 1000, 5000], help='candidate pool sizes to try (RECOMMENDATION_CANDIDATES)')
+    parser.add_argument('--from-db', action='store_true', help='use the stored events and embeddings instead of a synthetic catalog')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.from_db:
+        ids, texts, vectors, query_texts, query_vectors = load_db_catalog()
+        if len(query_texts) == 0:
+            raise SystemExit('No profile embeddings stored yet -> load the home page for some users first')
+    else:
+        ids, texts, vectors, query_texts, query_vectors = synthetic_catalog(rng, args.size, args.queries, args.dim, args.topics)
+
+    index = VectorIndex()
+    index.build(ids, vectors)
+    lexical = BM25Index()
+    start = time.perf_counter()
+    lexical.build(list(zip(ids, texts)))
+    build_seconds = time.perf_counter() - start
+
+    exact_results, exact_latencies = run_queries(lambda i: index.search(query_vectors[i], args.k), len(query_texts))
+
+    print(f'{len(ids)} events, {len(query_texts)} queries, BM25 index built in {build_seconds:.2f}s')
+    print(f'{"retrieval":>18} {"recall@" + str(args.k):>10} {"p50 (ms)":>10} {"p99 (ms)":>10}')
+    print(f'{"full scoring":>18} {1.0:>10.3f} {np.percentile(exact_latencies, 50):>10.3f} {np.percentile(exact_latencies, 99):>10.3f}')
+
+    for candidates in args.candidates:
+        def two_stage(i):
+            pool = [id for id, score in lexical.search(query_texts[i], candidates)]
+            return index.search_among(query_vectors[i], args.k, pool)
+        results, latencies = run_queries(two_stage, len(query_texts))
+        print(f'{"bm25 top " + str(candidates):>18} {recall(results, exact_results):>10.3f} {np.percentile(latencies, 50):>10.3f} {np.percentile(latencies, 99):>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
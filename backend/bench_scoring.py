@@ -0,0 +1,67 @@
+#benchmark of the recommendation scoring step -> run from the backend directory with `python bench_scoring.py`
+#compares the original per-event cosine loop + full sort against the pre-normalized VectorIndex with argpartition,
+#then times the MMR diversity rerank of a candidate pool (similarity matrix + selection)
+#uses random vectors, so no database or API key is needed
+import argparse
+import time
+import numpy as np
+from numpy import dot
+from numpy.linalg import norm
+from scoring import VectorIndex, normalize, mmr
+
+
+#the scoring code that match_events used before the VectorIndex
+def loop_top_k(user_embedding, event_embeddings, k):
+    similarities = [dot(user_embedding, event_embedding)/(norm(user_embedding)*norm(event_embedding)) for event_embedding in event_embeddings]
+    return sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)[:k]
+
+#median wall time of fn over repeats runs, in milliseconds
+def time_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark recommendation scoring latency against catalog size')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help='number of events to score')
+    parser.add_argument('--dim', type=int, default=1536, help='embedding dimensions (text-embedding-3-small has 1536)')
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--mmr-pool', type=int, nargs='+', default=[20, 100], help='candidate pool sizes for the MMR rerank')
+    parser.add_argument('--skip-loop-above', type=int, default=100000, help='do not time the original loop above this many events')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    print(f'{"events":>8} {"loop + sort (ms)":>18} {"index (ms)":>12} {"speedup":>9}')
+
+    for size in args.sizes:
+        event_embeddings = rng.standard_normal((size, args.dim), dtype=np.float32)
+        user_embedding = rng.standard_normal(args.dim, dtype=np.float32)
+
+        index = VectorIndex()
+        index.build(list(range(size)), event_embeddings)
+        index_ms = time_ms(lambda: index.search(user_embedding, args.k), args.repeats)
+
+        if size <= args.skip_loop_above:
+            loop_ms = time_ms(lambda: loop_top_k(user_embedding, event_embeddings, args.k), max(1, args.repeats // 2))
+            expected = loop_top_k(user_embedding, event_embeddings, args.k)
+            found = [event_id for event_id, score in index.search(user_embedding, args.k)]
+            assert found == expected, 'index and loop disagree on the top k'
+            print(f'{size:>8} {loop_ms:>18.2f} {index_ms:>12.3f} {loop_ms / index_ms:>8.0f}x')
+        else:
+            print(f'{size:>8} {"-":>18} {index_ms:>12.3f} {"-":>9}')
+
+    print(f'\n{"mmr pool":>8} {"rerank (ms)":>12}')
+    user_embedding = normalize(rng.standard_normal(args.dim, dtype=np.float32))
+    for pool in args.mmr_pool:
+        vectors = normalize(rng.standard_normal((pool, args.dim), dtype=np.float32))
+        rerank_ms = time_ms(lambda: mmr(vectors @ user_embedding, vectors @ vectors.T, args.k, 0.7), args.repeats * 20)
+        print(f'{pool:>8} {rerank_ms:>12.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#check of the statements the membership endpoints run -> run from the backend directory with `python check_queries.py`
+#calls every endpoint for a user registered for 1 event and for --events events (and an event with 1 and --events registrants)
+#and fails if the number of statements grows with the number of registrations (a query per row) or exceeds config.QUERY_BUDGET
+#works on a throwaway admin, users and events in the database, deleted afterwards
+import argparse
+import uuid
+from fastapi.testclient import TestClient
+import models
+import config
+from database import SessionLocal
+from main import app
+from query_counter import routes
+
+
+def new_user(run: str, name: str, is_admin: bool = False) -> models.User:
+    return models.User(id=str(uuid.uuid4()), email=f'queries-{run}-{name}@example.com', full_name='', password='', is_admin=is_admin, age=1, gender='m', phone_number='', work_status='student', immigration_status='citizen', skills='', interests='', past_volunteer_experience='')
+
+def new_event(run: str, name: str, capacity: int) -> models.Event:
+    return models.Event(id=str(uuid.uuid4()), title=f'queries-{run}-{name}', date='', time='', requirements='', capacity=capacity, deadline='', location='', description='', tasks='')
+
+#statements run by one call of the endpoint at path
+def count_queries(client: TestClient, method: str, path: str, **kwargs) -> int:
+    before = routes.get(path, {}).get('queries', 0)
+    client.request(method, path, **kwargs).raise_for_status()
+    return routes[path]['queries'] - before
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that the membership endpoints run a fixed number of queries')
+    parser.add_argument('--events', type=int, default=200, help='registrations of the large user and the large event')
+    args = parser.parse_args()
+
+    run = uuid.uuid4().hex[:8]
+    admin = new_user(run, 'admin', is_admin=True)
+    small_user, large_user = new_user(run, 'small'), new_user(run, 'large')
+    events = [new_event(run, str(i), args.events + 1) for i in range(args.events)]
+    registrants = [new_user(run, str(i)) for i in range(args.events - 1)]
+    small_event, large_event = events[1], events[0] #the large event gets large_user and every registrant, the small one only large_user
+
+    with SessionLocal() as db:
+        db.add_all([admin, small_user, large_user, *registrants, *events])
+        db.flush()
+        db.add_all([models.Registration(user_id=large_user.id, event_id=event.id) for event in events])
+        db.add(models.Registration(user_id=small_user.id, event_id=large_event.id))
+        db.add_all([models.Registration(user_id=user.id, event_id=large_event.id) for user in registrants[1:]])
+        db.commit()
+
+    checks = [
+        ('GET', '/user/get_user', lambda user, event: {'params': {'email': user.email}}),
+        ('GET', '/user/get_user_events', lambda user, event: {'params': {'email': user.email}}),
+        ('POST', '/admin/get_user', lambda user, event: {'json': {'curr_user_email': admin.email, 'new_user_email': user.email}}),
+        ('POST', '/event/get_users_registered', lambda user, event: {'json': {'email': admin.email, 'title': event.title}}),
+    ]
+    failed = False
+    try:
+        client = TestClient(app) #not entered as a context manager, so the background jobs of the startup event do not run
+        for method, path, request in checks:
+            small = count_queries(client, method, path, **request(small_user, small_event))
+            large = count_queries(client, method, path, **request(large_user, large_event))
+            ok = small == large <= config.QUERY_BUDGET
+            failed |= not ok
+            print(f'  {"ok  " if ok else "FAIL"} {path}: {small} statements for 1 registration, {large} for {args.events}')
+    finally:
+        with SessionLocal() as db:
+            db.query(models.Event).filter(models.Event.id.in_([event.id for event in events])).delete(synchronize_session=False)
+            db.query(models.User).filter(models.User.id.in_([user.id for user in (admin, small_user, large_user, *registrants)])).delete(synchronize_session=False)
+            db.commit()
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
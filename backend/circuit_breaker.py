@@ -0,0 +1,61 @@
+import threading
+import time
+
+
+class CircuitOpenError(Exception): #raised instead of calling a service that has been failing
+    pass
+
+
+#stops calling a failing service for a while -> after failure_threshold errors in a row the circuit opens and calls fail at once
+#once reset_seconds have passed a single trial call is let through: success closes the circuit, failure keeps it open for another reset_seconds
+class CircuitBreaker:
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.stats = {'failures': 0, 'rejected': 0, 'opened': 0}
+
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        return 'half_open' if time.monotonic() - self.opened_at >= self.reset_seconds else 'open'
+
+    def allow(self) -> bool:
+        with self.lock:
+            state = self.state()
+            if state == 'closed':
+                return True
+            if state == 'half_open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def call(self, fn):
+        if not self.allow():
+            raise CircuitOpenError('Service unavailable, calls are suspended after repeated failures')
+        try:
+            result = fn()
+        except Exception:
+            with self.lock:
+                self.stats['failures'] += 1
+                self.failures += 1
+                if self.trial_running or self.failures >= self.failure_threshold:
+                    if self.opened_at is None:
+                        self.stats['opened'] += 1
+                    self.opened_at = time.monotonic()
+                self.trial_running = False
+            raise
+
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_running = False
+        return result
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return dict(self.stats, state=self.state())
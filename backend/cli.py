@@ -0,0 +1,85 @@
+#maintenance commands for the backend -> run from the backend directory, e.g. `python cli.py backfill_embeddings`
+import argparse
+import models
+import config
+from database import SessionLocal
+from utils import ensure_schema
+from rate_limiter import background_priority
+from embedding_store import backfill_event_embeddings, get_stale_events
+from recommendations import rebuild_recommendations
+from eligibility import backfill_deadlines
+from registrations import migrate_registrations, clear_legacy_registrations
+
+
+def backfill_embeddings(db, args):
+    count = backfill_event_embeddings(db, only_stale=not args.all, batch_size=args.batch_size)
+    print(f'Embedded {count} events')
+
+def check_embeddings(db, args):
+    stale_events = get_stale_events(db)
+    total = db.query(models.Event).count()
+    print(f'{len(stale_events)} of {total} events have a missing or stale embedding')
+    for event in stale_events:
+        print(f'  {event.id}  {event.title}')
+
+def migrate_registrations_command(db, args):
+    if not config.LEGACY_REGISTRATION_ARRAYS:
+        raise SystemExit('LEGACY_REGISTRATION_ARRAYS is off, so the legacy arrays may be out of date and nothing is migrated from them')
+    count = migrate_registrations(db, batch_size=args.batch_size)
+    print(f'Copied {count} registrations into the registrations table')
+
+def clear_legacy_registrations_command(db, args):
+    if config.LEGACY_REGISTRATION_ARRAYS:
+        raise SystemExit('Set LEGACY_REGISTRATION_ARRAYS=0 on every backend instance (and here) once no older version is serving, then run this again')
+    count = clear_legacy_registrations(db, batch_size=args.batch_size)
+    print(f'Cleared the legacy registration arrays of {count} users and events')
+
+def backfill_deadlines_command(db, args):
+    count = backfill_deadlines(db)
+    print(f'Parsed the deadline of {count} events')
+
+def rebuild_recommendations_command(db, args):
+    count = rebuild_recommendations(db, k=args.k)
+    print(f'Rebuilt recommendations for {count} users')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Connect4Good backend maintenance commands')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backfill = subparsers.add_parser('backfill_embeddings', help='embed every event whose stored embedding is missing or stale')
+    backfill.add_argument('--all', action='store_true', help='re-embed every event, not only missing or stale ones')
+    backfill.add_argument('--batch-size', type=int, default=1000, help='number of events embedded per commit')
+    backfill.set_defaults(handler=backfill_embeddings)
+
+    check = subparsers.add_parser('check_embeddings', help='list events whose embedding is missing, from another model or out of date')
+    check.set_defaults(handler=check_embeddings)
+
+    migrate = subparsers.add_parser('migrate_registrations', help='sync the registrations table with the legacy ARRAY columns that older versions still write')
+    migrate.add_argument('--batch-size', type=int, default=1000, help='events migrated per transaction')
+    migrate.set_defaults(handler=migrate_registrations_command)
+
+    clear = subparsers.add_parser('clear_legacy_registrations', help='empty the legacy ARRAY columns once no older version is serving')
+    clear.add_argument('--batch-size', type=int, default=1000, help='users or events cleared per transaction')
+    clear.set_defaults(handler=clear_legacy_registrations_command)
+
+    deadlines = subparsers.add_parser('backfill_deadlines', help='parse the deadline of events created before deadline_at existed')
+    deadlines.set_defaults(handler=backfill_deadlines_command)
+
+    rebuild = subparsers.add_parser('rebuild_recommendations', help='recompute the stored top-k events of every user')
+    rebuild.add_argument('--k', type=int, default=None, help='events stored per user (defaults to RECOMMENDATION_STORE_K)')
+    rebuild.set_defaults(handler=rebuild_recommendations_command)
+
+    args = parser.parse_args()
+
+    ensure_schema() #same as the API -> the command can run before the server has ever started
+    db = SessionLocal()
+    try:
+        with background_priority(): #API requests from the running server go first
+            args.handler(db, args)
+    finally:
+        db.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import os
+
+#settings read from the environment -> the defaults are what a local checkout runs with
+
+OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
+
+#chat model used by openai_llm.generate_tasks -> both values are part of the llm_cache key
+CHAT_MODEL = os.environ.get('CHAT_MODEL', 'gpt-3.5-turbo-0125')
+CHAT_TEMPERATURE = float(os.environ.get('CHAT_TEMPERATURE', 0.5))
+
+#which backend computes embeddings -> 'openai' calls the API, 'local' hashes words in-process with no network (see embedding_providers.py)
+#switching provider or model marks every stored vector as stale -> run `python cli.py backfill_embeddings`
+EMBEDDING_PROVIDER = os.environ.get('EMBEDDING_PROVIDER', 'openai')
+OPENAI_EMBEDDING_MODEL = os.environ.get('OPENAI_EMBEDDING_MODEL', 'text-embedding-3-small')
+LOCAL_EMBEDDING_DIM = int(os.environ.get('LOCAL_EMBEDDING_DIM', 512))
+
+#how /user/get_similar_events searches the event vectors
+#'exact' scores every event, 'approximate' uses the IVF index in ann_index.py (worth it from tens of thousands of events)
+RECOMMENDATION_SEARCH = os.environ.get('RECOMMENDATION_SEARCH', 'exact')
+
+#number of IVF lists scanned per query in approximate mode -> higher means better recall and slower queries
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 8))
+
+#limits for openai_llm.get_embeddings_batch -> the embeddings API accepts at most 2048 inputs and 300k tokens per request
+EMBEDDING_BATCH_SIZE = int(os.environ.get('EMBEDDING_BATCH_SIZE', 512)) #inputs per request
+EMBEDDING_BATCH_TOKENS = int(os.environ.get('EMBEDDING_BATCH_TOKENS', 100000)) #tokens per request
+EMBEDDING_MAX_CONCURRENCY = int(os.environ.get('EMBEDDING_MAX_CONCURRENCY', 4)) #requests in flight at once
+
+#OpenAI rate limits enforced client-side by rate_limiter.py -> set them to your account's tier, slightly below is safer
+OPENAI_CHAT_RPM = int(os.environ.get('OPENAI_CHAT_RPM', 500)) #requests per minute
+OPENAI_CHAT_TPM = int(os.environ.get('OPENAI_CHAT_TPM', 60000)) #tokens per minute
+OPENAI_CHAT_MAX_CONCURRENCY = int(os.environ.get('OPENAI_CHAT_MAX_CONCURRENCY', 8)) #chat requests in flight at once per process
+CHAT_COMPLETION_TOKENS = int(os.environ.get('CHAT_COMPLETION_TOKENS', 300)) #expected length of a completion, counted against the TPM budget with the prompt
+OPENAI_EMBEDDING_RPM = int(os.environ.get('OPENAI_EMBEDDING_RPM', 3000))
+OPENAI_EMBEDDING_TPM = int(os.environ.get('OPENAI_EMBEDDING_TPM', 1000000))
+OPENAI_EMBEDDING_MAX_CONCURRENCY = int(os.environ.get('OPENAI_EMBEDDING_MAX_CONCURRENCY', 8))
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 5)) #retries of a request that got a 429 or 5xx
+OPENAI_BACKOFF_SECONDS = float(os.environ.get('OPENAI_BACKOFF_SECONDS', 1)) #first wait after an error without Retry-After, doubled on every further error
+OPENAI_MAX_BACKOFF_SECONDS = float(os.environ.get('OPENAI_MAX_BACKOFF_SECONDS', 60))
+
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get('OPENAI_TIMEOUT_SECONDS', 30)) #a single embeddings request is abandoned after this long
+
+#circuit breaker around the embedding API (see circuit_breaker.py) -> opens after this many failures in a row and lets a trial call through after the reset time
+EMBEDDING_BREAKER_FAILURES = int(os.environ.get('EMBEDDING_BREAKER_FAILURES', 5))
+EMBEDDING_BREAKER_RESET_SECONDS = float(os.environ.get('EMBEDDING_BREAKER_RESET_SECONDS', 30))
+
+#request coalescing (see singleflight.py) -> how long a caller waits on an identical call that is already in flight
+EMBEDDING_FLIGHT_TIMEOUT_SECONDS = float(os.environ.get('EMBEDDING_FLIGHT_TIMEOUT_SECONDS', 30))
+LLM_FLIGHT_TIMEOUT_SECONDS = float(os.environ.get('LLM_FLIGHT_TIMEOUT_SECONDS', 120))
+
+#materialized recommendations (see recommendations.py)
+RECOMMENDATION_STORE_K = int(os.environ.get('RECOMMENDATION_STORE_K', 20)) #events stored per user -> requests for more than this are scored live
+RECOMMENDATION_TTL_SECONDS = int(os.environ.get('RECOMMENDATION_TTL_SECONDS', 7200)) #older rows are treated as missing
+RECOMMENDATION_REFRESH_SECONDS = int(os.environ.get('RECOMMENDATION_REFRESH_SECONDS', 3600)) #interval of the background rebuild, 0 disables it
+#events preselected by keywords (BM25 over title, description, requirements and tasks) before live scoring reranks them by embedding -> 0 scores every event
+#a smaller pool is faster but misses events that match in meaning without sharing words, `python bench_retrieval.py` measures both
+RECOMMENDATION_CANDIDATES = int(os.environ.get('RECOMMENDATION_CANDIDATES', 0))
+#diversity rerank of /user/get_similar_events (maximal marginal relevance, see scoring.mmr) -> 1 keeps the plain relevance order, e.g. 0.7 avoids near-duplicate events
+#the top RECOMMENDATION_MMR_POOL events are reranked, pools up to RECOMMENDATION_STORE_K are served from the stored lists
+RECOMMENDATION_MMR_LAMBDA = float(os.environ.get('RECOMMENDATION_MMR_LAMBDA', 1))
+RECOMMENDATION_MMR_POOL = int(os.environ.get('RECOMMENDATION_MMR_POOL', 20))
+RECOMMENDATION_DEADLINE_SECONDS = float(os.environ.get('RECOMMENDATION_DEADLINE_SECONDS', 2)) #live scoring taking longer falls back to stale or cached results
+RECOMMENDATION_LIVE_WORKERS = int(os.environ.get('RECOMMENDATION_LIVE_WORKERS', 8)) #live scorings running at once per process, requests beyond that fall back straight away
+RECOMMENDATION_CHUNK_SIZE = int(os.environ.get('RECOMMENDATION_CHUNK_SIZE', 256)) #users scored per matrix product during a rebuild
+
+#cache of generate_tasks responses (see llm_cache.py)
+LLM_CACHE_TTL_SECONDS = int(os.environ.get('LLM_CACHE_TTL_SECONDS', 7 * 24 * 3600)) #older entries are generated again
+LLM_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_CACHE_MAX_ENTRIES', 10000)) #least recently used entries are evicted above this
+
+#background task generation (see job_queue.py)
+TASK_JOB_WORKERS = int(os.environ.get('TASK_JOB_WORKERS', 2)) #jobs run at once per backend process (the concurrency limit of bulk generation), 0 disables the workers
+TASK_JOB_POLL_SECONDS = float(os.environ.get('TASK_JOB_POLL_SECONDS', 2)) #how often idle workers look for jobs queued by other processes
+TASK_JOB_LEASE_SECONDS = int(os.environ.get('TASK_JOB_LEASE_SECONDS', 300)) #a running job is retried after this long without finishing
+TASK_JOB_MAX_ATTEMPTS = int(os.environ.get('TASK_JOB_MAX_ATTEMPTS', 3)) #a job is marked failed after this many errors
+TASK_JOB_BACKOFF_SECONDS = float(os.environ.get('TASK_JOB_BACKOFF_SECONDS', 5)) #wait before the first retry, doubled for every further attempt
+TASK_JOB_RETENTION_SECONDS = int(os.environ.get('TASK_JOB_RETENTION_SECONDS', 24 * 3600)) #finished jobs are deleted after this long
+
+#each backend process (e.g. under `uvicorn --workers N`) keeps its own in-memory event, user and keyword indexes (see index_sync.py)
+INDEX_SYNC_SECONDS = float(os.environ.get('INDEX_SYNC_SECONDS', 5)) #how often a process catches up with rows other processes changed, 0 for a single process
+
+#registrations are also written to the legacy users.events_registered/events.users_registered arrays while older versions of the backend may
+#still be serving (see registrations.py) -> set to 0 on every instance once none is left, then run `python cli.py clear_legacy_registrations`
+LEGACY_REGISTRATION_ARRAYS = os.environ.get('LEGACY_REGISTRATION_ARRAYS', '1') == '1'
+
+#statements per request (see query_counter.py) -> requests running more are counted as over_budget in /metrics, a sign of a query per row
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 15))
+
+#event list pages (see event_pages.py)
+EVENTS_PAGE_SIZE = int(os.environ.get('EVENTS_PAGE_SIZE', 20)) #events per page of /event/get_events unless the request sets limit
+EVENTS_MAX_PAGE_SIZE = int(os.environ.get('EVENTS_MAX_PAGE_SIZE', 100))
+EVENTS_EXACT_COUNT_BELOW = int(os.environ.get('EVENTS_EXACT_COUNT_BELOW', 1000)) #totals the planner estimates below this are counted exactly
+
+#event search (see event_search.py)
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 20)) #results per page of /event/search unless the request sets limit
+AUTOCOMPLETE_LIMIT = int(os.environ.get('AUTOCOMPLETE_LIMIT', 10)) #titles returned by /event/autocomplete
+AUTOCOMPLETE_MIN_LENGTH = int(os.environ.get('AUTOCOMPLETE_MIN_LENGTH', 3)) #shorter texts get no suggestions -> the trigram index needs 3 characters, anything shorter would scan every title
+
+#level of the backend's log messages (failed embeddings, fallbacks, background job errors) -> 'DEBUG', 'INFO', 'WARNING' or 'ERROR'
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
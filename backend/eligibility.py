@@ -0,0 +1,57 @@
+from datetime import datetime
+from dateutil import parser as date_parser
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+import models
+from registrations import registered_event_ids
+
+#events a user can still register for -> not full, registration deadline not passed, not joined already
+#closed events (full or past their deadline) pile up as the catalog ages, so they are kept out of the event index altogether (see
+#embedding_store.py) and scoring only masks the few events the user joined; eligible_event_ids checks a given short list, e.g. a stored recommendation row
+
+
+#parses the free-text deadline of an event -> None if it cannot be read, such events are treated as still open
+#a deadline without a time of day lasts until the end of that day
+def parse_deadline(text: str):
+    now = datetime.utcnow()
+    try:
+        return date_parser.parse(text, default=datetime(now.year, now.month, now.day, 23, 59, 59))
+    except (ValueError, OverflowError, TypeError):
+        return None
+
+#criteria of an open event, for use in a query filter
+def open_event_filter() -> list:
+    return [models.Event.registered_count < models.Event.capacity, or_(models.Event.deadline_at == None, models.Event.deadline_at > datetime.utcnow())]
+
+#whether users can still register for an event -> row needs registered_count, capacity and deadline_at
+def is_open(row) -> bool:
+    return row.registered_count < row.capacity and (row.deadline_at is None or row.deadline_at > datetime.utcnow())
+
+#ids of the events the user joined, to pass as exclude to the event index
+def joined_by(db: Session, user_id: str) -> set:
+    return {event_id for (event_id,) in db.execute(registered_event_ids(user_id)).all()}
+
+#ids of the events each of the given users joined -> {user_id: set of event ids}, users without registrations are missing
+def joined_event_ids(db: Session, user_ids: list) -> dict:
+    joined = {}
+    for user_id, event_id in db.query(models.Registration.user_id, models.Registration.event_id).filter(models.Registration.user_id.in_(user_ids)).all():
+        joined.setdefault(user_id, set()).add(event_id)
+    return joined
+
+#ids of the events the user can register for -> only among the given ids if among is set
+def eligible_event_ids(db: Session, user: models.User, among: list = None) -> set:
+    query = db.query(models.Event.id).filter(*open_event_filter(), models.Event.id.not_in(registered_event_ids(user.id)))
+    if among is not None:
+        query = query.filter(models.Event.id.in_(among))
+    return {event_id for (event_id,) in query.all()}
+
+
+#fills deadline_at for events created before the column existed -> returns the number of events updated
+def backfill_deadlines(db: Session) -> int:
+    events = db.query(models.Event).filter(models.Event.deadline_at == None).all()
+    updated = 0
+    for event in events:
+        event.deadline_at = parse_deadline(event.deadline)
+        updated += event.deadline_at is not None
+    db.commit()
+    return updated
@@ -0,0 +1,82 @@
+import hashlib
+import math
+import re
+from abc import ABC, abstractmethod
+from collections import Counter
+from functools import lru_cache
+import numpy as np
+import config
+
+
+class EmbeddingProvider(ABC): #interface every embedding backend implements -> a provider without embed fails when it is created
+    model_name = None #stored next to every vector -> switching provider or model marks the stored vectors as stale
+    requires_network = True #remote providers get their inputs chunked and sent concurrently by openai_llm.get_embeddings_batch
+
+    #returns one embedding (a list of floats) per text, in input order
+    @abstractmethod
+    def embed(self, texts: list) -> list:
+        pass
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider): #the OpenAI embeddings API -> one HTTP request per call to embed
+    def __init__(self, api_key: str, model: str):
+        from openai import OpenAI
+        self.client = OpenAI(api_key=api_key, max_retries=0, timeout=config.OPENAI_TIMEOUT_SECONDS) #retries are done by the scheduler in rate_limiter.py
+        self.model_name = model
+
+    def embed(self, texts: list) -> list:
+        response = self.client.embeddings.create(input=texts, model=self.model_name)
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+
+#common words that would otherwise dominate the hashed vectors
+STOP_WORDS = frozenset('a an and are as at be by for from has have i in is it my of on or that the this to was were will with'.split())
+
+#lowercased words of a text without stop words -> also used by the keyword ranking in recommendations.py
+def tokenize(text: str) -> list:
+    return [word for word in re.findall(r'[a-z0-9]+', text.lower()) if word not in STOP_WORDS]
+
+class LocalEmbeddingProvider(EmbeddingProvider): #hashed bag-of-words vectors computed in-process -> no network, deterministic and microseconds per text
+    #every word and word pair is hashed to one of dim signed buckets and weighted by 1 + log(count), then the vector is normalized
+    #texts sharing vocabulary get a high cosine similarity, which is enough for tests, load runs and a degraded mode
+    requires_network = False
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.model_name = f'local-hashed-bow-{dim}'
+
+    @staticmethod
+    @lru_cache(maxsize=100000)
+    def bucket(feature: str, dim: int) -> tuple:
+        value = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+        return value % dim, 1.0 if value >> 63 else -1.0 #the top bit picks the sign so collisions cancel out on average
+
+    def embed_one(self, text: str) -> list:
+        words = tokenize(text)
+        features = Counter(words + [first + ' ' + second for first, second in zip(words, words[1:])])
+
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in features.items():
+            position, sign = self.bucket(feature, self.dim)
+            vector[position] += sign * (1 + math.log(count))
+
+        length = np.linalg.norm(vector)
+        return (vector / length if length else vector).tolist()
+
+    def embed(self, texts: list) -> list:
+        return [self.embed_one(text) for text in texts]
+
+
+provider = None
+
+#returns the provider selected by config.EMBEDDING_PROVIDER, created on first use so nothing connects at import time
+def get_embedding_provider() -> EmbeddingProvider:
+    global provider
+    if provider is None:
+        if config.EMBEDDING_PROVIDER == 'openai':
+            provider = OpenAIEmbeddingProvider(config.OPENAI_API_KEY, config.OPENAI_EMBEDDING_MODEL)
+        elif config.EMBEDDING_PROVIDER == 'local':
+            provider = LocalEmbeddingProvider(config.LOCAL_EMBEDDING_DIM)
+        else:
+            raise ValueError(f"EMBEDDING_PROVIDER must be 'openai' or 'local', got {config.EMBEDDING_PROVIDER!r}")
+    return provider
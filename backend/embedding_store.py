@@ -0,0 +1,440 @@
+import hashlib
+import heapq
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import models
+from openai_llm import get_embeddings, get_embeddings_batch, get_embedding_model
+from scoring import VectorIndex
+from ann_index import IVFIndex
+from eligibility import open_event_filter, is_open
+from index_sync import IndexSync, newest
+import config
+
+logger = logging.getLogger(__name__)
+
+
+#picks the exact or approximate event index based on config.RECOMMENDATION_SEARCH
+def create_event_index():
+    if config.RECOMMENDATION_SEARCH == 'exact':
+        return VectorIndex()
+    if config.RECOMMENDATION_SEARCH == 'approximate':
+        return IVFIndex(nprobe=config.IVF_NPROBE)
+    raise ValueError(f"RECOMMENDATION_SEARCH must be 'exact' or 'approximate', got {config.RECOMMENDATION_SEARCH!r}")
+
+#the embedding of every event users can still register for, shared by all requests of this process
+#filled from the stored vectors of the open events on first use and kept in sync by the event and registration endpoints (see
+#recommendations.update_event_recommendations) -> full and past-deadline events are left out, so searches never have to mask them
+event_index = create_event_index()
+
+#(deadline_at, event_id) of the indexed events that have a deadline, soonest first -> expire_events takes them out once it passes
+#indexed_deadlines holds the current deadline of each of them, so entries left behind by a moved deadline are skipped
+event_deadlines = []
+indexed_deadlines = {}
+deadline_lock = threading.Lock()
+
+#events whose vector is missing from event_index because they were never embedded, their description changed or embedding them failed
+#embedded on the next get_event_index call, without reloading the rest of the index
+#the call claims them by moving them to claimed_events, so concurrent requests do not embed the same events again while it runs
+pending_events = set()
+claimed_events = set()
+pending_lock = threading.Lock()
+
+#profile vectors by user id, for every user whose profile embedding is already cached -> filled on first use, never calls the API
+#used to score one event against all users at once
+user_index = VectorIndex()
+
+#users left out of user_index because their profile was not embedded yet -> looked at again when another process caches new profile vectors
+unembedded_users = set()
+user_lock = threading.Lock()
+
+#changes made by other processes are picked up through these (see index_sync.py)
+event_sync = IndexSync()
+user_sync = IndexSync()
+
+
+#text that gets embedded for an event -> only the description is used for matching
+def event_text(event: models.Event) -> str:
+    return event.description
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+#a stored vector is only usable if it was produced by the current model from the current text
+def is_fresh(model: str, stored_hash: str, event: models.Event) -> bool:
+    return model == get_embedding_model() and stored_hash == text_hash(event_text(event))
+
+
+#computes the embedding of an event and stores it, replacing any previous vector
+#does not commit -> the caller commits together with its own changes
+def store_event_embedding(db: Session, event: models.Event, embedding: list = None) -> models.EventEmbedding:
+    text = event_text(event)
+    if embedding is None:
+        embedding = get_embeddings(text)
+
+    row = db.get(models.EventEmbedding, event.id)
+    if row is None:
+        row = models.EventEmbedding(event_id=event.id)
+        db.add(row)
+
+    row.model = get_embedding_model()
+    row.text_hash = text_hash(text)
+    row.embedding = embedding
+    row.updated_at = datetime.utcnow()
+    return row
+
+
+#stores the embedding of an event that was just created or changed and commits it -> returns the new embedding, which the caller puts into the
+#event index if the event is open
+#if the embedding API fails the event write still stands and None is returned -> the vector is filled in lazily by get_event_index or by the backfill command
+def refresh_event_embedding(db: Session, event: models.Event):
+    try:
+        row = store_event_embedding(db, event)
+        db.commit()
+    except Exception as error:
+        db.rollback()
+        logger.warning('Could not embed event %s: %r', event.id, error)
+        event_index.remove(event.id) #its old vector no longer matches the description
+        add_pending_event(event.id)
+        return None
+
+    with pending_lock:
+        pending_events.discard(event.id)
+        claimed_events.discard(event.id) #a running embed_pending_events may hold the vector of the old description
+    return row.embedding
+
+
+#returns a dict of {event_id: embedding} for the given events
+#vectors that are missing or stale are computed and stored here, so this only calls the API for events that were never embedded
+def get_event_embeddings(db: Session, events: list) -> dict:
+    if not events:
+        return {}
+
+    rows = db.query(models.EventEmbedding).filter(models.EventEmbedding.event_id.in_([event.id for event in events])).all()
+    rows = {row.event_id: row for row in rows}
+
+    vectors = {}
+    missing = []
+    for event in events:
+        row = rows.get(event.id)
+        if row is not None and is_fresh(row.model, row.text_hash, event):
+            vectors[event.id] = row.embedding
+        else:
+            missing.append(event)
+
+    if missing:
+        #one batched call for everything that is missing instead of one request per event
+        for event, embedding in zip(missing, get_embeddings_batch([event_text(event) for event in missing])):
+            vectors[event.id] = store_event_embedding(db, event, embedding).embedding
+        db.commit()
+
+    return vectors
+
+
+#returns the events whose stored embedding is missing, was produced by another model or no longer matches the description
+def get_stale_events(db: Session) -> list:
+    #only the model and hash columns are loaded -> the vectors themselves are not needed to decide staleness
+    rows = db.query(models.Event, models.EventEmbedding.model, models.EventEmbedding.text_hash).outerjoin(models.EventEmbedding, models.EventEmbedding.event_id == models.Event.id).all()
+    return [event for event, model, stored_hash in rows if not is_fresh(model, stored_hash, event)]
+
+
+#embeds every stale event (or every event if only_stale is False) with one batched call and one commit per batch_size events
+#returns the number of events that were embedded
+def backfill_event_embeddings(db: Session, only_stale: bool = True, batch_size: int = 1000) -> int:
+    events = get_stale_events(db) if only_stale else db.query(models.Event).all()
+
+    for start in range(0, len(events), batch_size):
+        batch = events[start:start + batch_size]
+        for event, embedding in zip(batch, get_embeddings_batch([event_text(event) for event in batch])):
+            store_event_embedding(db, event, embedding)
+        db.commit()
+
+    return len(events)
+
+
+#text that gets embedded for a user -> same concatenation that match_events has always used
+def profile_text(user: models.User) -> str:
+    return user.skills + ' ' + user.interests + ' ' + user.past_volunteer_experience
+
+#the model name is part of the key so switching models never returns a vector from the old one
+def profile_key(text: str) -> str:
+    return text_hash(get_embedding_model() + '\n' + text)
+
+
+#returns the embedding of a user's profile, only calling the API if no user with the same profile text was embedded before
+def get_profile_embedding(db: Session, user: models.User) -> list:
+    text = profile_text(user)
+    key = profile_key(text)
+
+    row = db.get(models.ProfileEmbedding, key)
+    if row is not None:
+        embedding = row.embedding
+    else:
+        embedding = get_embeddings(text)
+        #two requests for the same profile can race here -> the second insert is simply dropped
+        db.execute(insert(models.ProfileEmbedding).values(key=key, model=get_embedding_model(), embedding=embedding, created_at=datetime.utcnow()).on_conflict_do_nothing(index_elements=['key']))
+        db.commit()
+
+    if user_index.loaded:
+        user_index.upsert(user.id, embedding)
+        with user_lock:
+            unembedded_users.discard(user.id)
+    return embedding
+
+
+#batched version of get_profile_embedding -> one query for the cached vectors and one batched API call for the misses
+#returns one embedding per user, in the same order
+def get_profile_embeddings(db: Session, users: list) -> list:
+    keys = [profile_key(profile_text(user)) for user in users]
+    vectors = dict(db.query(models.ProfileEmbedding.key, models.ProfileEmbedding.embedding).filter(models.ProfileEmbedding.key.in_(set(keys))).all())
+
+    missing = {} #key -> text, so identical profiles are only embedded once
+    for user, key in zip(users, keys):
+        if key not in vectors:
+            missing[key] = profile_text(user)
+
+    if missing:
+        embeddings = get_embeddings_batch(list(missing.values()))
+        model = get_embedding_model()
+        now = datetime.utcnow()
+        db.execute(insert(models.ProfileEmbedding).on_conflict_do_nothing(index_elements=['key']), [{'key': key, 'model': model, 'embedding': embedding, 'created_at': now} for key, embedding in zip(missing, embeddings)])
+        db.commit()
+        vectors.update(zip(missing, embeddings))
+
+    if user_index.loaded:
+        for user, key in zip(users, keys):
+            user_index.upsert(user.id, vectors[key])
+        with user_lock:
+            unembedded_users.difference_update(user.id for user in users)
+    return [vectors[key] for key in keys]
+
+
+#removes the cached embedding for a user's current profile text, unless another user still has exactly the same text
+#called before a profile changes or a user is deleted -> does not commit, the caller commits with its own changes
+def invalidate_profile_embedding(db: Session, user: models.User):
+    text = profile_text(user)
+    user_text = models.User.skills + ' ' + models.User.interests + ' ' + models.User.past_volunteer_experience
+    shared = db.query(models.User.id).filter(models.User.id != user.id, user_text == text).first()
+    if shared:
+        return
+
+    db.query(models.ProfileEmbedding).filter(models.ProfileEmbedding.key == profile_key(text)).delete(synchronize_session=False)
+
+
+#marks an open event whose vector is not in the index -> embedded by the next get_event_index
+def add_pending_event(event_id: str):
+    with pending_lock:
+        pending_events.add(event_id)
+
+#adds or replaces the vector of an open event in the loaded index
+def index_event(event_id: str, embedding: list, deadline_at: datetime = None):
+    if not event_index.loaded:
+        return
+    event_index.upsert(event_id, embedding)
+    with deadline_lock:
+        if deadline_at is None:
+            indexed_deadlines.pop(event_id, None)
+        elif indexed_deadlines.get(event_id) != deadline_at:
+            indexed_deadlines[event_id] = deadline_at
+            heapq.heappush(event_deadlines, (deadline_at, event_id))
+
+#takes events out of the index once their registration deadline passed -> one heap pop per deadline, nothing is scanned
+def expire_events():
+    now = datetime.utcnow()
+    with deadline_lock:
+        while event_deadlines and event_deadlines[0][0] <= now:
+            deadline_at, event_id = heapq.heappop(event_deadlines)
+            if indexed_deadlines.get(event_id) == deadline_at:
+                del indexed_deadlines[event_id]
+                event_index.remove(event_id)
+
+#fills event_index from the fresh stored vectors of the open events, once per process (or after reset_db) -> never calls the API
+#the open filter is served by the partial index ix_events_open, open events without a fresh vector are added to pending_events instead
+def load_event_index(db: Session):
+    if event_index.loaded:
+        return
+    event_sync.loaded(event_watermark(db))
+    rows = db.query(models.Event.id, models.Event.description, models.Event.deadline_at, models.EventEmbedding.model, models.EventEmbedding.text_hash, models.EventEmbedding.embedding).outerjoin(models.EventEmbedding, models.EventEmbedding.event_id == models.Event.id).filter(*open_event_filter()).all()
+    fresh = [row for row in rows if is_fresh(row.model, row.text_hash, row)]
+    with pending_lock:
+        pending_events.clear()
+        pending_events.update(row.id for row in rows if not is_fresh(row.model, row.text_hash, row))
+    with deadline_lock:
+        indexed_deadlines.clear()
+        indexed_deadlines.update((row.id, row.deadline_at) for row in fresh if row.deadline_at is not None)
+        event_deadlines[:] = [(deadline_at, event_id) for event_id, deadline_at in indexed_deadlines.items()]
+        heapq.heapify(event_deadlines)
+    event_index.build([row.id for row in fresh], [row.embedding for row in fresh])
+
+#embeds the pending events that are still open in one batched call and adds them to the loaded index
+#if the API fails they stay pending and the index is used without them
+def embed_pending_events(db: Session):
+    with pending_lock:
+        event_ids = list(pending_events)
+        pending_events.clear()
+        claimed_events.update(event_ids)
+    if not event_ids:
+        return
+    try:
+        events = db.query(models.Event).filter(models.Event.id.in_(event_ids), *open_event_filter()).all()
+        vectors = get_event_embeddings(db, events)
+    except Exception as error:
+        db.rollback()
+        logger.warning('Could not embed %d pending events: %r', len(event_ids), error)
+        with pending_lock:
+            pending_events.update(claimed_events.intersection(event_ids)) #retried by the next call
+            claimed_events.difference_update(event_ids)
+        return
+    with pending_lock:
+        current = claimed_events.intersection(event_ids) #events re-embedded by their own update meanwhile are left alone
+        claimed_events.difference_update(event_ids) #ids of events deleted or closed meanwhile are dropped too
+    for event in events:
+        if event.id in current:
+            index_event(event.id, vectors[event.id], event.deadline_at)
+
+
+#newest write to events or event_embeddings
+def event_watermark(db: Session):
+    return newest(db.query(func.max(models.Event.updated_at)).scalar(), db.query(func.max(models.EventEmbedding.updated_at)).scalar())
+
+#catches event_index up with the events and embeddings other processes changed since the last sync: events that opened or got a new vector
+#go in, events that closed go out, open events without a fresh vector become pending -> see index_sync.py
+#indexed events another process deleted are only noticed by the count of open events, which reloads the index if it holds more than that
+def sync_event_index(db: Session):
+    since = event_sync.start()
+    if since is None or not event_index.loaded:
+        return
+    through = event_watermark(db)
+    open_count = db.query(func.count(models.Event.id)).filter(*open_event_filter()).scalar() #ix_events_open
+    changed = {event_id for (event_id,) in db.query(models.Event.id).filter(models.Event.updated_at > since).all()}
+    changed.update(event_id for (event_id,) in db.query(models.EventEmbedding.event_id).filter(models.EventEmbedding.updated_at > since).all())
+    if changed:
+        rows = db.query(models.Event.id, models.Event.description, models.Event.registered_count, models.Event.capacity, models.Event.deadline_at, models.EventEmbedding.model, models.EventEmbedding.text_hash, models.EventEmbedding.embedding).outerjoin(models.EventEmbedding, models.EventEmbedding.event_id == models.Event.id).filter(models.Event.id.in_(changed)).all()
+        for row in rows:
+            if is_open(row) and is_fresh(row.model, row.text_hash, row):
+                index_event(row.id, row.embedding, row.deadline_at)
+            else:
+                event_index.remove(row.id)
+                if is_open(row):
+                    add_pending_event(row.id)
+    event_sync.advance(through)
+
+    expire_events()
+    if len(event_index) > open_count:
+        logger.info('Event index holds %d events but %d are open, reloading it', len(event_index), open_count)
+        event_index.loaded = False
+        load_event_index(db)
+
+#returns the in-memory event index, loading it from the stored vectors on first use and embedding the events still missing from it
+def get_event_index(db: Session):
+    load_event_index(db)
+    sync_event_index(db)
+    expire_events()
+    embed_pending_events(db)
+    return event_index
+
+
+#returns the event index without calling the API -> events still missing from it are simply not scored
+#used by the recommendation fallback while the embedding API is unavailable
+def get_cached_event_index(db: Session):
+    load_event_index(db)
+    sync_event_index(db)
+    expire_events()
+    return event_index
+
+#returns {event_id: vector} for the given events without calling the API -> from the loaded index, otherwise from their stored fresh vectors
+#events without a usable vector are missing from the result
+def get_cached_event_vectors(db: Session, event_ids: list) -> dict:
+    vectors = {}
+    if event_index.loaded:
+        known = [event_id for event_id in event_ids if event_id in event_index]
+        vectors.update(zip(known, event_index.get_vectors(known)))
+    missing = [event_id for event_id in event_ids if event_id not in vectors]
+    if missing:
+        rows = db.query(models.Event.id, models.Event.description, models.EventEmbedding.model, models.EventEmbedding.text_hash, models.EventEmbedding.embedding).join(models.EventEmbedding, models.EventEmbedding.event_id == models.Event.id).filter(models.Event.id.in_(missing)).all()
+        vectors.update((row.id, row.embedding) for row in rows if is_fresh(row.model, row.text_hash, row))
+    return vectors
+
+#returns the stored embedding of a user's profile, or None if it was never embedded -> never calls the API
+def get_cached_profile_embedding(db: Session, user: models.User):
+    if user_index.loaded and user.id in user_index:
+        return user_index.get_vectors([user.id])[0]
+    row = db.get(models.ProfileEmbedding, profile_key(profile_text(user)))
+    return None if row is None else row.embedding
+
+
+#puts the cached profile vectors of the given users into user_index -> users whose profile was never embedded are taken out and remembered in
+#unembedded_users; users are rows with id, skills, interests and past_volunteer_experience
+def index_users(db: Session, users: list):
+    keys = {user.id: profile_key(profile_text(user)) for user in users}
+    cached = dict(db.query(models.ProfileEmbedding.key, models.ProfileEmbedding.embedding).filter(models.ProfileEmbedding.key.in_(set(keys.values()))).all())
+    for user_id, key in keys.items():
+        if key in cached:
+            user_index.upsert(user_id, cached[key])
+        else:
+            user_index.remove(user_id)
+    with user_lock:
+        unembedded_users.difference_update(user_id for user_id, key in keys.items() if key in cached)
+        unembedded_users.update(user_id for user_id, key in keys.items() if key not in cached)
+
+#newest write to users or profile_embeddings
+def user_watermark(db: Session):
+    return newest(db.query(func.max(models.User.updated_at)).scalar(), db.query(func.max(models.ProfileEmbedding.created_at)).scalar())
+
+def load_user_index(db: Session):
+    user_sync.loaded(user_watermark(db))
+    users = db.query(models.User.id, models.User.skills, models.User.interests, models.User.past_volunteer_experience).all()
+    user_index.build([], [])
+    with user_lock:
+        unembedded_users.clear()
+    for start in range(0, len(users), 1000):
+        index_users(db, users[start:start + 1000])
+
+#catches user_index up with the users other processes created or changed since the last sync, and with the users whose profile another process
+#embedded meanwhile -> users another process deleted are only noticed by the user count, which reloads the index if it holds more than that
+def sync_user_index(db: Session):
+    since = user_sync.start()
+    if since is None or not user_index.loaded:
+        return
+    through = user_watermark(db)
+    user_count = db.query(func.count(models.User.id)).scalar()
+    columns = (models.User.id, models.User.skills, models.User.interests, models.User.past_volunteer_experience)
+    users = db.query(*columns).filter(models.User.updated_at > since).all()
+    if db.query(models.ProfileEmbedding.key).filter(models.ProfileEmbedding.created_at > since).first() is not None:
+        with user_lock:
+            waiting = list(unembedded_users)
+        for start in range(0, len(waiting), 1000):
+            users += db.query(*columns).filter(models.User.id.in_(waiting[start:start + 1000])).all()
+    if users:
+        index_users(db, users)
+    user_sync.advance(through)
+
+    if len(user_index) > user_count:
+        logger.info('User index holds %d users but only %d exist, reloading it', len(user_index), user_count)
+        load_user_index(db)
+
+#returns the in-memory user index, loading every cached profile vector from the database on first use
+def get_user_index(db: Session) -> VectorIndex:
+    if not user_index.loaded:
+        load_user_index(db)
+    else:
+        sync_user_index(db)
+    return user_index
+
+#returns the user index with every user in it -> users whose profile was never embedded are embedded in one batched call
+#a count query detects new users, so once everyone is embedded this costs no API call at all
+#users another process deleted are dropped on the way, so the count matches again afterwards
+def get_complete_user_index(db: Session) -> VectorIndex:
+    index = get_user_index(db)
+    if db.query(models.User).count() != len(index):
+        users = db.query(models.User.id, models.User.skills, models.User.interests, models.User.past_volunteer_experience).all()
+        existing = {user.id for user in users}
+        for user_id in [user_id for user_id in list(index.ids) if user_id not in existing]:
+            index.remove(user_id)
+        missing = [user for user in users if user.id not in index]
+        for start in range(0, len(missing), 1000):
+            get_profile_embeddings(db, missing[start:start + 1000]) #adds the vectors to the index as a side effect
+    return index
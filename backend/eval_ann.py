@@ -0,0 +1,83 @@
+#evaluates the approximate event index against exact search -> run from the backend directory with `python eval_ann.py`
+#reports recall@k of IVFIndex against VectorIndex and p50/p99 query latency of both
+#by default uses synthetic clustered vectors, --from-db uses the stored event embeddings and profile embeddings as queries
+import argparse
+import time
+import numpy as np
+from scoring import VectorIndex
+from ann_index import IVFIndex
+
+
+#gaussian clusters around random centres -> closer to real embeddings than uniform noise, which no index can partition well
+def synthetic_vectors(rng, size: int, dim: int, clusters: int) -> np.ndarray:
+    centres = rng.standard_normal((clusters, dim), dtype=np.float32)
+    return centres[rng.integers(0, clusters, size)] + 0.6 * rng.standard_normal((size, dim), dtype=np.float32)
+
+def load_db_vectors():
+    import models
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        events = db.query(models.EventEmbedding.event_id, models.EventEmbedding.embedding).all()
+        profiles = db.query(models.ProfileEmbedding.embedding).all()
+    finally:
+        db.close()
+    return [event_id for event_id, embedding in events], np.array([embedding for event_id, embedding in events], dtype=np.float32), np.array([embedding for (embedding,) in profiles], dtype=np.float32)
+
+#runs every query through search, returning the result ids and the latency of each query in milliseconds
+def run_queries(index, queries, k: int):
+    results = []
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        found = index.search(query, k)
+        latencies.append((time.perf_counter() - start) * 1000)
+        results.append([id for id, score in found])
+    return results, np.array(latencies)
+
+def recall(approximate: list, exact: list) -> float:
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approximate, exact) if e]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recall and latency of approximate vs exact event search')
+    parser.add_argument('--size', type=int, default=50000, help='number of synthetic events')
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--clusters', type=int, default=200, help='number of topics in the synthetic catalog')
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+    parser.add_argument('--from-db', action='store_true', help='use the stored embeddings instead of synthetic vectors')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    if args.from_db:
+        ids, vectors, queries = load_db_vectors()
+        if len(queries) == 0:
+            raise SystemExit('No profile embeddings stored yet -> load the home page for some users first')
+    else:
+        vectors = synthetic_vectors(rng, args.size + args.queries, args.dim, args.clusters)
+        vectors, queries = vectors[:args.size], vectors[args.size:]
+        ids = list(range(args.size))
+
+    exact = VectorIndex()
+    exact.build(ids, vectors)
+    exact_results, exact_latencies = run_queries(exact, queries, args.k)
+
+    approximate = IVFIndex()
+    start = time.perf_counter()
+    approximate.build(ids, vectors)
+    build_seconds = time.perf_counter() - start
+
+    print(f'{len(ids)} events, {len(queries)} queries, {len(approximate.lists)} lists, built in {build_seconds:.2f}s')
+    print(f'{"search":>16} {"recall@" + str(args.k):>10} {"p50 (ms)":>10} {"p99 (ms)":>10}')
+    print(f'{"exact":>16} {1.0:>10.3f} {np.percentile(exact_latencies, 50):>10.3f} {np.percentile(exact_latencies, 99):>10.3f}')
+
+    for nprobe in args.nprobe:
+        approximate.nprobe = nprobe
+        results, latencies = run_queries(approximate, queries, args.k)
+        print(f'{"ivf nprobe=" + str(nprobe):>16} {recall(results, exact_results):>10.3f} {np.percentile(latencies, 50):>10.3f} {np.percentile(latencies, 99):>10.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import and_, or_, tuple_
+from sqlalchemy.orm import Session
+import models
+import config
+
+#pages of the event list with keyset pagination -> a page continues after the sort key of the last event of the previous page,
+#so every page costs one index range scan however deep it is (OFFSET would read and throw away all the rows before it)
+#only the columns shown in the list are loaded, never descriptions or embeddings
+
+
+SORTS = ('title', 'deadline') #'title' is alphabetical, 'deadline' is soonest registration deadline first (events without one last)
+COLUMNS = (models.Event.id, models.Event.title, models.Event.date, models.Event.time, models.Event.location, models.Event.capacity, models.Event.registered_count, models.Event.deadline_at)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+#cursors are opaque to clients -> the sort they were made for and the sort key of the last event, as url-safe base64 json
+def encode_cursor(sort: str, key: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps([sort, *key]).encode()).decode()
+
+#returns the sort key of a cursor, with the deadline parsed back into a datetime
+def decode_cursor(cursor: str, sort: str) -> list:
+    try:
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if sort == 'deadline' and value is not None:
+            value = datetime.fromisoformat(value)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+    if cursor_sort != sort:
+        raise InvalidCursor('Cursor belongs to a different sort')
+    if not isinstance(id, str) or (sort == 'title' and not isinstance(value, str)):
+        raise InvalidCursor('Invalid cursor')
+    return [value, id]
+
+def sort_key(sort: str, row) -> list:
+    if sort == 'deadline':
+        return [row.deadline_at.isoformat() if row.deadline_at else None, row.id]
+    return [row.title, row.id]
+
+#filter continuing after the sort key of a cursor -> the id breaks ties between equal titles or deadlines
+def after_key(sort: str, key: list):
+    value, id = key
+    if sort == 'title':
+        return tuple_(models.Event.title, models.Event.id) > tuple_(value, id)
+    if value is None: #already among the events without a deadline, which come last
+        return and_(models.Event.deadline_at == None, models.Event.id > id)
+    return or_(models.Event.deadline_at > value, and_(models.Event.deadline_at == value, models.Event.id > id), models.Event.deadline_at == None)
+
+def order_by(sort: str) -> list:
+    if sort == 'deadline':
+        return [models.Event.deadline_at.asc().nulls_last(), models.Event.id]
+    return [models.Event.title, models.Event.id]
+
+
+#criteria of the optional filters, for use in a query filter
+#upcoming -> registration deadline not passed (events whose deadline could not be read count as upcoming), has_seats -> not full
+def event_filters(upcoming: bool, has_seats: bool) -> list:
+    filters = []
+    if upcoming:
+        filters.append(or_(models.Event.deadline_at == None, models.Event.deadline_at > datetime.utcnow()))
+    if has_seats:
+        filters.append(models.Event.registered_count < models.Event.capacity)
+    return filters
+
+#number of rows the query returns -> exact for small results, the planner's estimate from EXPLAIN above config.EVENTS_EXACT_COUNT_BELOW
+#so the total never costs a scan of a large table
+def estimate_count(db: Session, query) -> int:
+    compiled = query.statement.compile(dialect=db.get_bind().dialect)
+    plan = db.connection().exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    estimate = int(plan[0]['Plan']['Plan Rows'])
+    if estimate < config.EVENTS_EXACT_COUNT_BELOW:
+        return query.count()
+    return estimate
+
+
+#one page of events -> returns (rows, next_cursor), next_cursor is None on the last page
+#raises InvalidCursor if the cursor cannot be read or was made for another sort
+def get_event_page(db: Session, limit: int, cursor: str = None, sort: str = 'title', upcoming: bool = False, has_seats: bool = False) -> tuple:
+    query = db.query(*COLUMNS).filter(*event_filters(upcoming, has_seats))
+    if cursor:
+        query = query.filter(after_key(sort, decode_cursor(cursor, sort)))
+    rows = query.order_by(*order_by(sort)).limit(limit + 1).all() #one extra row tells whether there is a next page
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(sort, sort_key(sort, rows[-1]))
+
+def count_events(db: Session, upcoming: bool = False, has_seats: bool = False) -> int:
+    return estimate_count(db, db.query(models.Event.id).filter(*event_filters(upcoming, has_seats)))
@@ -0,0 +1,59 @@
+from sqlalchemy import Float, and_, cast, func, or_
+from sqlalchemy.orm import Session
+import models
+import config
+from event_pages import COLUMNS, InvalidCursor, encode_cursor, decode_cursor, event_filters, estimate_count
+
+#full-text search of events in postgres -> matches come from the GIN index on events.search_vector (a stored generated column, so no
+#document is parsed at query time) and are ranked with ts_rank_cd, best first
+#autocomplete matches title substrings through the trigram index on events.title
+
+
+#words typed by the user -> websearch syntax, so "quoted phrases", or and -excluded words work and nothing the user types is a syntax error
+def search_query(text: str):
+    return func.websearch_to_tsquery('english', text)
+
+#rank of an event for the query, as double precision so it survives the round trip through a cursor unchanged
+def search_rank(query):
+    return cast(func.ts_rank_cd(models.Event.search_vector, query), Float)
+
+def decode_search_cursor(cursor: str) -> list:
+    rank, id = decode_cursor(cursor, 'search')
+    if not isinstance(rank, (int, float)) or isinstance(rank, bool):
+        raise InvalidCursor('Invalid cursor')
+    return [rank, id]
+
+
+#one page of events matching the text, best match first -> returns (rows with a rank column, next_cursor, total_estimate)
+#next_cursor continues after the (rank, id) of the last row and is None on the last page, total_estimate counts the matches of every page
+#raises InvalidCursor if the cursor cannot be read or was made for the event list
+def search_events(db: Session, text: str, limit: int, cursor: str = None, upcoming: bool = False, has_seats: bool = False) -> tuple:
+    query = search_query(text)
+    rank = search_rank(query)
+    criteria = [models.Event.search_vector.bool_op('@@')(query), *event_filters(upcoming, has_seats)]
+    matches = db.query(*COLUMNS, rank.label('rank')).filter(*criteria)
+    if cursor:
+        last_rank, last_id = decode_search_cursor(cursor)
+        matches = matches.filter(or_(rank < last_rank, and_(rank == last_rank, models.Event.id > last_id)))
+    total = estimate_count(db, db.query(models.Event.id).filter(*criteria))
+
+    rows = matches.order_by(rank.desc(), models.Event.id).limit(limit + 1).all() #one extra row tells whether there is a next page
+    if len(rows) <= limit:
+        return rows, None, total
+    rows = rows[:limit]
+    return rows, encode_cursor('search', [rows[-1].rank, rows[-1].id]), total
+
+
+#escapes the LIKE wildcards in text typed by the user
+def like_escape(text: str) -> str:
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+#titles containing the typed text, for autocomplete -> titles starting with it first, then the most similar ones
+#served by the trigram index, so texts shorter than config.AUTOCOMPLETE_MIN_LENGTH get no suggestions
+def autocomplete_titles(db: Session, text: str, limit: int) -> list:
+    text = text.strip()
+    if len(text) < config.AUTOCOMPLETE_MIN_LENGTH:
+        return []
+    prefix = models.Event.title.ilike(like_escape(text) + '%', escape='\\')
+    rows = db.query(models.Event.title).filter(models.Event.title.ilike('%' + like_escape(text) + '%', escape='\\')).order_by(prefix.desc(), func.similarity(models.Event.title, text).desc(), models.Event.title).limit(limit).all()
+    return [title for (title,) in rows]
@@ -0,0 +1,46 @@
+import threading
+import time
+from datetime import datetime, timedelta
+import config
+
+#the event, user and keyword indexes live in the memory of each backend process, but with `uvicorn --workers N` the other processes change the
+#rows they were loaded from -> each index keeps an IndexSync, and at most every config.INDEX_SYNC_SECONDS it re-reads the rows changed since its
+#last sync (by their updated_at column) and compares a row count to notice deleted rows, reloading only then
+
+
+OVERLAP = timedelta(seconds=60) #changes are read again for this long, since a slow transaction can commit a timestamp older than one already seen
+EPOCH = datetime(1970, 1, 1) #catch-up start of an index loaded from empty tables
+
+
+class IndexSync:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checked_at = time.monotonic()
+        self.through = None #newest updated_at seen when the index was loaded or last synced
+
+    #called when the index is (re)loaded -> newest is the newest updated_at, read before the rows so nothing written meanwhile is missed
+    def loaded(self, newest):
+        with self.lock:
+            self.through = newest
+            self.checked_at = time.monotonic()
+
+    #returns the updated_at to catch up from if a sync is due, otherwise None -> only one request per interval gets it, the others go on
+    #with the index as it is
+    def start(self):
+        with self.lock:
+            if config.INDEX_SYNC_SECONDS <= 0 or time.monotonic() - self.checked_at < config.INDEX_SYNC_SECONDS:
+                return None
+            self.checked_at = time.monotonic()
+            return (self.through or EPOCH) - OVERLAP
+
+    #records the newest updated_at a sync read
+    def advance(self, newest):
+        with self.lock:
+            if newest is not None and (self.through is None or newest > self.through):
+                self.through = newest
+
+
+#the newest of the given timestamps, ignoring None (max of an empty table)
+def newest(*timestamps):
+    present = [timestamp for timestamp in timestamps if timestamp is not None]
+    return max(present) if present else None
@@ -0,0 +1,143 @@
+import logging
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_, text, func
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import models
+import config
+from database import SessionLocal
+from llm_cache import task_prompt, cache_key, generate_tasks_cached
+from rate_limiter import background_priority
+
+logger = logging.getLogger(__name__)
+
+#the task_jobs table is the queue -> any backend process can enqueue, and a bounded pool of worker threads per process runs the jobs
+#jobs are claimed with FOR UPDATE SKIP LOCKED so several processes can share the queue, and a job whose worker died is picked up again once its lease expires
+
+IN_FLIGHT = text("status IN ('queued', 'running')") #must match the predicate of ix_task_jobs_in_flight
+
+wakeup = threading.Event() #set on enqueue so idle workers of this process start at once instead of at their next poll
+last_cleanup = 0.0
+
+
+#queues a generate_tasks job and returns its id
+#if the user already has an identical job queued or running, that job's id is returned instead of queueing a second one
+def enqueue_job(db: Session, event: models.Event, user: models.User, force_refresh: bool = False) -> str:
+    key = cache_key(task_prompt(event, user))
+    while True:
+        now = datetime.utcnow()
+        statement = insert(models.TaskJob).values(id=str(uuid.uuid4()), user_id=user.id, event_id=event.id, prompt_key=key, force_refresh=force_refresh, status='queued', created_at=now, updated_at=now)
+        job_id = db.execute(statement.on_conflict_do_nothing(index_elements=['user_id', 'prompt_key'], index_where=IN_FLIGHT).returning(models.TaskJob.id)).scalar()
+        if job_id is None:
+            job_id = db.query(models.TaskJob.id).filter(models.TaskJob.user_id == user.id, models.TaskJob.prompt_key == key, IN_FLIGHT).scalar()
+        db.commit()
+
+        if job_id is not None: #None only if the identical job finished between the two statements -> queue a new one
+            wakeup.set()
+            return job_id
+
+#queues one job per user for the same event in a single statement -> returns the batch id and the number of jobs queued
+#users that already have an identical job queued or running are skipped, since that job will produce the same tasks
+def enqueue_event_jobs(db: Session, event: models.Event, users: list, force_refresh: bool = False) -> tuple:
+    batch_id = str(uuid.uuid4())
+    if not users:
+        return batch_id, 0
+
+    now = datetime.utcnow()
+    rows = [{'id': str(uuid.uuid4()), 'user_id': user.id, 'event_id': event.id, 'prompt_key': cache_key(task_prompt(event, user)), 'force_refresh': force_refresh, 'status': 'queued', 'batch_id': batch_id, 'created_at': now, 'updated_at': now} for user in users]
+    queued = db.execute(insert(models.TaskJob).values(rows).on_conflict_do_nothing(index_elements=['user_id', 'prompt_key'], index_where=IN_FLIGHT).returning(models.TaskJob.id)).scalars().all()
+    db.commit()
+    wakeup.set()
+    return batch_id, len(queued)
+
+#counts the jobs of a batch by status -> returns {'total': n, 'queued': n, 'running': n, 'done': n, 'failed': n}
+def batch_progress(db: Session, batch_id: str) -> dict:
+    counts = dict(db.query(models.TaskJob.status, func.count()).filter(models.TaskJob.batch_id == batch_id).group_by(models.TaskJob.status).all())
+    progress = {status: counts.get(status, 0) for status in ('queued', 'running', 'done', 'failed')}
+    progress['total'] = sum(counts.values())
+    return progress
+
+
+#marks the oldest runnable job as running and returns it, or None if the queue is empty
+#single jobs (no batch) go first, so a bulk generation does not hold up users waiting on their own request
+def claim_job(db: Session):
+    now = datetime.utcnow()
+    runnable = or_(and_(models.TaskJob.status == 'queued', or_(models.TaskJob.run_after == None, models.TaskJob.run_after <= now)), and_(models.TaskJob.status == 'running', models.TaskJob.lease_expires_at < now))
+    job = db.query(models.TaskJob).filter(runnable).order_by(models.TaskJob.batch_id != None, models.TaskJob.created_at).with_for_update(skip_locked=True).first()
+    if job is None:
+        db.rollback()
+        return None
+
+    job.status = 'running'
+    job.lease_expires_at = now + timedelta(seconds=config.TASK_JOB_LEASE_SECONDS)
+    job.updated_at = now
+    db.commit()
+    return job
+
+#runs a claimed job and stores the result per (user, event) in generated_tasks
+#errors (rate limits, timeouts) are retried with exponential backoff and jitter, up to config.TASK_JOB_MAX_ATTEMPTS attempts
+def run_job(db: Session, job: models.TaskJob):
+    event = db.get(models.Event, job.event_id)
+    user = db.get(models.User, job.user_id)
+    now = datetime.utcnow()
+    try:
+        job.result = generate_tasks_cached(db, event, user, force_refresh=job.force_refresh)
+        job.status = 'done'
+        statement = insert(models.GeneratedTasks).values(user_id=user.id, event_id=event.id, response=job.result, generated_at=now)
+        db.execute(statement.on_conflict_do_update(index_elements=['user_id', 'event_id'], set_={'response': statement.excluded.response, 'generated_at': statement.excluded.generated_at}))
+    except Exception as error:
+        db.rollback()
+        job.attempts += 1
+        job.error = str(error)
+        if job.attempts < config.TASK_JOB_MAX_ATTEMPTS:
+            job.status = 'queued'
+            job.run_after = now + timedelta(seconds=config.TASK_JOB_BACKOFF_SECONDS * 2 ** (job.attempts - 1) * random.uniform(0.5, 1.5))
+        else:
+            job.status = 'failed'
+
+    job.lease_expires_at = None
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+#deletes finished jobs older than config.TASK_JOB_RETENTION_SECONDS -> run by idle workers at most once a minute
+def delete_finished_jobs(db: Session):
+    global last_cleanup
+    if time.monotonic() - last_cleanup < 60:
+        return
+    last_cleanup = time.monotonic()
+    cutoff = datetime.utcnow() - timedelta(seconds=config.TASK_JOB_RETENTION_SECONDS)
+    db.query(models.TaskJob).filter(models.TaskJob.status.in_(['done', 'failed']), models.TaskJob.updated_at < cutoff).delete(synchronize_session=False)
+    db.commit()
+
+
+def worker_loop():
+    with background_priority(): #model calls of the workers wait for requests that a user is waiting on
+        run_worker()
+
+def run_worker():
+    while True:
+        db = SessionLocal()
+        job = None
+        try:
+            job = claim_job(db)
+            if job is not None:
+                run_job(db, job)
+            else:
+                delete_finished_jobs(db)
+        except Exception: #e.g. the job's user or event was deleted while it ran
+            logger.exception('Task job worker error')
+        finally:
+            db.close()
+
+        if job is None:
+            wakeup.wait(config.TASK_JOB_POLL_SECONDS)
+            wakeup.clear()
+
+#starts config.TASK_JOB_WORKERS daemon threads -> called once when the API starts
+def start_workers():
+    for i in range(config.TASK_JOB_WORKERS):
+        threading.Thread(target=worker_loop, name=f'task-job-worker-{i}', daemon=True).start()
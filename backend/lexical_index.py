@@ -0,0 +1,122 @@
+import heapq
+import math
+import threading
+from collections import Counter, defaultdict
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+import models
+from embedding_providers import tokenize
+from index_sync import IndexSync
+
+
+class BM25Index: #in-memory inverted index with BM25 ranking -> word -> {id: count} postings, updated one document at a time
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.lock = threading.Lock()
+        self.k1 = k1 #how quickly repeated words stop adding to the score
+        self.b = b #how much long documents are penalized
+        self.loaded = False
+        self.clear()
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def clear(self):
+        self.postings = defaultdict(dict)
+        self.lengths = {} #id -> number of words
+        self.words = {} #id -> distinct words, so a document can be removed without scanning every posting list
+        self.total_length = 0
+
+    #replaces the whole content of the index with the (id, text) pairs
+    def build(self, documents: list):
+        with self.lock:
+            self.clear()
+            for id, text in documents:
+                self.add(id, text)
+            self.loaded = True
+
+    def add(self, id, text: str):
+        words = tokenize(text)
+        counts = Counter(words)
+        for word, count in counts.items():
+            self.postings[word][id] = count
+        self.lengths[id] = len(words)
+        self.words[id] = list(counts)
+        self.total_length += len(words)
+
+    def discard(self, id):
+        for word in self.words.pop(id, ()):
+            postings = self.postings[word]
+            del postings[id]
+            if not postings:
+                del self.postings[word]
+        self.total_length -= self.lengths.pop(id, 0)
+
+    def upsert(self, id, text: str):
+        with self.lock:
+            self.discard(id)
+            self.add(id, text)
+
+    def remove(self, id):
+        with self.lock:
+            self.discard(id)
+
+    #returns up to n (id, score) pairs of the documents sharing at least one word with the text, best first
+    def search(self, text: str, n: int) -> list:
+        query = set(tokenize(text))
+        scores = defaultdict(float)
+        with self.lock:
+            if not self.lengths:
+                return []
+            count = len(self.lengths)
+            average_length = self.total_length / count or 1
+            for word in query:
+                postings = self.postings.get(word)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for id, frequency in postings.items():
+                    length_norm = 1 - self.b + self.b * self.lengths[id] / average_length
+                    scores[id] += idf * frequency * (self.k1 + 1) / (frequency + self.k1 * length_norm)
+        return heapq.nlargest(n, scores.items(), key=lambda item: item[1])
+
+
+#text of an event that is searched by keywords -> every field describing what the event is about
+def lexical_text(event) -> str:
+    return ' '.join((event.title, event.description, event.requirements, event.tasks))
+
+#words of every event, shared by all requests of this process
+#filled from the database on first use, kept in sync by the event endpoints and caught up with the changes of other processes (see index_sync.py)
+event_text_index = BM25Index()
+text_sync = IndexSync()
+
+TEXT_COLUMNS = (models.Event.id, models.Event.title, models.Event.description, models.Event.requirements, models.Event.tasks)
+
+def load_lexical_index(db: Session):
+    text_sync.loaded(db.query(func.max(models.Event.updated_at)).scalar())
+    event_text_index.build([(event.id, lexical_text(event)) for event in db.query(*TEXT_COLUMNS).all()])
+
+#re-reads the events other processes changed since the last sync -> events they deleted are only noticed by the event count, which rebuilds
+#the index if it holds more than that
+def sync_lexical_index(db: Session):
+    since = text_sync.start()
+    if since is None:
+        return
+    through = db.query(func.max(models.Event.updated_at)).scalar()
+    event_count = db.query(func.count(models.Event.id)).scalar()
+    for event in db.query(*TEXT_COLUMNS).filter(models.Event.updated_at > since).all():
+        event_text_index.upsert(event.id, lexical_text(event))
+    text_sync.advance(through)
+    if len(event_text_index) > event_count:
+        load_lexical_index(db)
+
+def get_lexical_index(db: Session) -> BM25Index:
+    if not event_text_index.loaded:
+        load_lexical_index(db)
+    else:
+        sync_lexical_index(db)
+    return event_text_index
+
+#updates the index after an event was created or changed -> does nothing until the index is loaded, since loading reads the current rows anyway
+def index_event_text(event: models.Event):
+    if event_text_index.loaded:
+        event_text_index.upsert(event.id, lexical_text(event))
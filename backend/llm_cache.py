@@ -0,0 +1,110 @@
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import models
+import config
+from database import SessionLocal
+from openai_llm import build_task_prompt, complete, stream_completion
+from singleflight import get_flight
+
+#hit/miss counters of this process -> reported by /metrics
+stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+stats_lock = threading.Lock()
+
+def count(name: str, amount: int = 1):
+    with stats_lock:
+        stats[name] += amount
+
+task_flights = get_flight('generate_tasks', config.LLM_FLIGHT_TIMEOUT_SECONDS)
+
+
+#renders the generate_tasks prompt from the event and user rows -> same text /user/generate_tasks has always sent
+def task_prompt(event: models.Event, user: models.User) -> str:
+    event_description = 'Event Description: \n' + event.description + '\n\n' + 'Event Tasks: \n' + event.tasks
+    user_description = 'User Skills: \n' + user.skills + '\n\n' + 'User Interests: \n' + user.interests + '\n\n' + 'User Past Volunteer Experience: \n' + user.past_volunteer_experience
+    return build_task_prompt(event_description, user_description)
+
+#the model parameters are part of the key so changing model or temperature never returns an old completion
+def cache_key(prompt: str) -> str:
+    return hashlib.sha256(f'{config.CHAT_MODEL}\n{config.CHAT_TEMPERATURE}\n{prompt}'.encode('utf-8')).hexdigest()
+
+
+#returns the cached response for a prompt, or None if it is missing or older than the TTL
+def get_cached_response(db: Session, key: str):
+    row = db.get(models.LLMResponse, key)
+    if row is None or datetime.utcnow() - row.created_at > timedelta(seconds=config.LLM_CACHE_TTL_SECONDS):
+        return None
+    row.last_used_at = datetime.utcnow()
+    db.commit()
+    return row.response
+
+#stores a response, replacing any previous one for the same key, then evicts the least recently used entries above the size cap
+def store_response(db: Session, key: str, response: str, user_id: str, event_id: str):
+    now = datetime.utcnow()
+    statement = insert(models.LLMResponse).values(key=key, user_id=user_id, event_id=event_id, response=response, created_at=now, last_used_at=now)
+    db.execute(statement.on_conflict_do_update(index_elements=['key'], set_={'response': statement.excluded.response, 'created_at': now, 'last_used_at': now}))
+
+    excess = db.query(models.LLMResponse).count() - config.LLM_CACHE_MAX_ENTRIES
+    if excess > 0:
+        oldest = db.query(models.LLMResponse.key).order_by(models.LLMResponse.last_used_at).limit(excess)
+        evicted = db.query(models.LLMResponse).filter(models.LLMResponse.key.in_(oldest.scalar_subquery())).delete(synchronize_session=False)
+        count('evictions', evicted)
+    db.commit()
+
+
+#returns personalized tasks for a user and an event, only calling the model on a cache miss or when force_refresh is set
+def generate_tasks_cached(db: Session, event: models.Event, user: models.User, force_refresh: bool = False) -> str:
+    prompt = task_prompt(event, user)
+    key = cache_key(prompt)
+
+    if not force_refresh:
+        response = get_cached_response(db, key)
+        if response is not None:
+            count('hits')
+            return response
+
+    #identical requests in flight at the same time (e.g. a double-clicked generate) share one completion, stored once by the first caller
+    def generate():
+        count('misses')
+        response = complete(prompt)
+        store_response(db, key, response, user.id, event.id)
+        return response
+    return task_flights.do(key, generate)
+
+
+#streaming version of generate_tasks_cached -> yields the response in pieces as the model produces them
+#a cache hit is yielded as a single piece, a completed stream is stored in the cache
+#uses its own session since it runs after the request handler has returned
+def stream_tasks_cached(event: models.Event, user: models.User, force_refresh: bool = False):
+    prompt = task_prompt(event, user)
+    key = cache_key(prompt)
+    user_id, event_id = user.id, event.id
+
+    db = SessionLocal()
+    try:
+        if not force_refresh:
+            response = get_cached_response(db, key)
+            if response is not None:
+                count('hits')
+                yield response
+                return
+
+        count('misses')
+        pieces = []
+        for piece in stream_completion(prompt):
+            pieces.append(piece)
+            yield piece
+        store_response(db, key, ''.join(pieces), user_id, event_id)
+    finally:
+        db.close()
+
+
+#drops every cached response for a user or an event whose row changed -> does not commit
+#the key already changes with the prompt, this keeps outdated entries from taking up space until they are evicted
+def invalidate_responses(db: Session, user_id: str = None, event_id: str = None):
+    if user_id is not None:
+        db.query(models.LLMResponse).filter(models.LLMResponse.user_id == user_id).delete(synchronize_session=False)
+    if event_id is not None:
+        db.query(models.LLMResponse).filter(models.LLMResponse.event_id == event_id).delete(synchronize_session=False)
@@ -1,22 +1,49 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 import schemas, models #schemas represents format expecting from frontend, models represents database format
-from database import Base, engine, SessionLocal
-from utils import get_password_hash, verify_password, reset_db
-from openai_llm import generate_tasks, get_embeddings, get_cosine_similarity
+from database import SessionLocal
+from utils import get_password_hash, verify_password, reset_db, ensure_schema
+from llm_cache import generate_tasks_cached, stream_tasks_cached, invalidate_responses, stats as llm_cache_stats
+from embedding_store import refresh_event_embedding, get_event_embeddings, get_complete_user_index, event_index, user_index, invalidate_profile_embedding, profile_text
+from recommendations import get_recommendations, diversify, batch_recommendations, update_event_recommendations, update_stored_lists, start_refresh_thread
+from singleflight import get_stats as single_flight_stats
+from openai_llm import chat_scheduler, embedding_scheduler, embedding_breaker
+from eligibility import parse_deadline
+from lexical_index import event_text_index, index_event_text
+from registrations import registered_event_titles, registered_user_emails, registered_user_ids, is_registered as user_is_registered, register, unregister, waitlist_position, promote_waitlist, release_user_seats, migrate_registrations
+from job_queue import enqueue_job, enqueue_event_jobs, batch_progress, start_workers
+from event_pages import get_event_page, count_events, InvalidCursor, SORTS as EVENT_SORTS
+from event_search import search_events, autocomplete_titles
+from query_counter import session_queries, record_request, get_stats as query_stats
+import config
+import logging
 import uuid
+import json
 
-Base.metadata.create_all(bind=engine) #creates the tables in the database if they don't exist
+logging.basicConfig(level=config.LOG_LEVEL, format='%(asctime)s %(levelname)s %(name)s: %(message)s') #messages of the backend modules, uvicorn keeps its own format
 
-def get_session(): #function to get the database session
+ensure_schema() #creates the tables in the database if they don't exist and adds columns/indexes added since
+if config.LEGACY_REGISTRATION_ARRAYS:
+    with SessionLocal() as migration_db:
+        migrate_registrations(migration_db) #copies registrations older versions wrote to the legacy ARRAY columns into the registrations table
+
+def get_session(request: Request): #function to get the database session
     session = SessionLocal()
     try:
         yield session
     finally:
         session.close()
+        route = request.scope.get('route')
+        record_request(route.path if route else request.url.path, session_queries(session)) #statements per endpoint -> reported by /metrics
 
 app = FastAPI()
 
+@app.on_event('startup')
+def start_background_jobs():
+    start_refresh_thread() #periodically recomputes the recommendations table
+    start_workers() #runs queued task generation jobs
+
 
 #call this endpoint to register a user
 #expecting a JSON in the schema of UserCreate
@@ -70,6 +97,9 @@ def login_user(request: schemas.UserLogin, db: Session = Depends(get_session)):
 @app.post('/reset_db')
 def reset_database():
     reset_db()
+    event_index.loaded = False #in-memory vectors of the dropped rows are reloaded on the next request
+    user_index.loaded = False
+    event_text_index.loaded = False
     return {'message': 'Database reset successfully'}
 
 
@@ -82,12 +112,7 @@ def get_user(email: str, db: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events_registered = []
-    for event_id in user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        if not event:
-            continue
-        events_registered.append(event.title)
+    events_registered = registered_event_titles(db, user.id)
     
     return {'email': user.email,
             'full_name': user.full_name,
@@ -125,6 +150,12 @@ def update_user(request: schemas.UserCreate, db: Session = Depends(get_session))
     if request.immigration_status.lower() not in schemas.profile_choices['immigration_status']:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Immigration Status: Citizen, PR, Student Visa, or Other')
     
+    if request.skills + ' ' + request.interests + ' ' + request.past_volunteer_experience != profile_text(user):
+        invalidate_profile_embedding(db, user) #drop the cached vector of the old profile text
+        db.query(models.Recommendation).filter(models.Recommendation.user_id == user.id).delete(synchronize_session=False) #stored recommendations were scored against the old profile
+        user_index.remove(user.id)
+    invalidate_responses(db, user_id=user.id) #cached generated tasks were written for the old profile
+    
     user.email = request.email
     user.full_name = request.full_name
     user.password = get_password_hash(request.password)
@@ -150,8 +181,13 @@ def delete_user(email: str, db: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
+    invalidate_profile_embedding(db, user)
+    event_ids = release_user_seats(db, user.id) #the user's seats go to the next users on the waitlists
     db.delete(user)
     db.commit()
+    user_index.remove(user.id)
+    for event_id in event_ids:
+        update_event_recommendations(db, event_id) #a full event may have reopened
     return {'message': 'User and Profile deleted successfully'}
 
 
@@ -224,12 +260,17 @@ def create_event(request: schemas.ChangeEvent, db: Session = Depends(get_session
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Capacity')
     
     unique_id = str(uuid.uuid4())
-    new_event = models.Event(id=unique_id, title=request.title, date=request.date, time=request.time, requirements=request.requirements, capacity=request.capacity, deadline=request.deadline, location=request.location, description=request.description, tasks=request.tasks)
+    new_event = models.Event(id=unique_id, title=request.title, date=request.date, time=request.time, requirements=request.requirements, capacity=request.capacity, deadline=request.deadline, deadline_at=parse_deadline(request.deadline), location=request.location, description=request.description, tasks=request.tasks)
 
     db.add(new_event)
     db.commit()
     db.refresh(new_event)
     
+    index_event_text(new_event)
+    embedding = refresh_event_embedding(db, new_event) #embed the description once here instead of on every recommendation request
+    if embedding is not None:
+        update_event_recommendations(db, new_event.id, embedding) #index the new event and merge it into the stored top-k lists it belongs in
+    
     return {'message': 'Event created successfully'}
 
 
@@ -251,17 +292,27 @@ def update_event(request: schemas.ChangeEvent, db: Session = Depends(get_session
     if request.capacity <= 0:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for Capacity')
     
+    description_changed = event.description != request.description
+    invalidate_responses(db, event_id=event.id) #cached generated tasks were written for the old event
+    
     event.title = request.title
     event.date = request.date
     event.time = request.time
     event.requirements = request.requirements
     event.capacity = request.capacity
     event.deadline = request.deadline
+    event.deadline_at = parse_deadline(request.deadline)
     event.location = request.location
     event.description = request.description
     event.tasks = request.tasks
     
+    promote_waitlist(db, event.id) #a raised capacity frees seats
     db.commit()
+    index_event_text(event)
+    
+    embedding = refresh_event_embedding(db, event) if description_changed else None #only re-embed when the embedded text changed
+    update_event_recommendations(db, event.id, embedding) #also takes the event out if a lower capacity or earlier deadline closed it, and back in if it reopened
+    
     return {'message': 'Event updated successfully'}
 
 
@@ -282,6 +333,9 @@ def delete_event(request: schemas.AdminEvent, db: Session = Depends(get_session)
     
     db.delete(event)
     db.commit()
+    event_index.remove(event.id)
+    event_text_index.remove(event.id)
+    update_stored_lists(db, event.id) #refill only the users who had the event in their list
     return {'message': 'Event deleted successfully'}
 
 
@@ -307,10 +361,12 @@ def get_event(title: str, db: Session = Depends(get_session)):
     
 
 #call this endpoint to let user register for a volunteer event
-#expecting the email of the user and the title of the event as strings
-#returning a JSON with a success message in the form {'message': message} or a corresponding error message
+#seats are taken atomically, so simultaneous signups can never overbook an event
+#expecting the email of the user and the title of the event as strings, and optionally waitlist=true to join the waitlist if the event is full
+#returning a JSON with a success message in the form {'message': message}, plus {'waitlist_position': position} when waitlisted, or a corresponding error message
+#waitlisted users are registered automatically, in order, when seats free up
 @app.post('/event/register_event')
-def register_event(email: str, title: str, db: Session = Depends(get_session)):
+def register_event(email: str, title: str, waitlist: bool = False, db: Session = Depends(get_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
@@ -318,20 +374,19 @@ def register_event(email: str, title: str, db: Session = Depends(get_session)):
     event = db.query(models.Event).filter(models.Event.title == title).first()
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
-    if len(event.users_registered) >= event.capacity:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event is full already')
     
-    #check if user is already registered for the event
-    if user.id in event.users_registered:
+    result = register(db, user.id, event.id, join_waitlist=waitlist)
+    if result == 'full':
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event is full already')
+    if result == 'already_registered':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User already registered for event')
-    
-    event.users_registered = event.users_registered + [user.id]
-    user.events_registered = user.events_registered + [event.id]
-    db.commit()
+    if result in ('waitlisted', 'already_waitlisted'):
+        return {'message': 'Event is full, user added to the waitlist', 'waitlist_position': waitlist_position(db, user.id, event.id)}
+    update_event_recommendations(db, event.id) #the last seat takes the event out of recommendations
     return {'message': 'User registered for event successfully'}
 
 
-#call this endpoint to let user unregister from a volunteer event
+#call this endpoint to let user unregister from a volunteer event, or leave its waitlist -> a freed seat goes to the first user on the waitlist
 #expecting the email of the user and the title of the event as strings
 #returning a JSON with a success message in the form {'message': message} or a corresponding error message
 @app.post('/event/unregister_event')
@@ -344,13 +399,12 @@ def unregister_event(email: str, title: str, db: Session = Depends(get_session))
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    #check if user is registered for the event
-    if user.id not in event.users_registered:
+    result = unregister(db, user.id, event.id)
+    if result == 'not_registered':
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not registered for event')
-    
-    event.users_registered = [x for x in event.users_registered if x != user.id]
-    user.events_registered = [x for x in user.events_registered if x != event.id]
-    db.commit()
+    if result == 'left_waitlist':
+        return {'message': 'User removed from the waitlist successfully'}
+    update_event_recommendations(db, event.id) #a full event reopens if nobody was waiting for the seat
     return {'message': 'User unregistered from event successfully'}
 
 
@@ -369,12 +423,7 @@ def get_event_registers(request: schemas.AdminEvent, db: Session = Depends(get_s
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    users_registered = []
-    for user_id in event.users_registered:
-        user = db.query(models.User).filter(models.User.id == user_id).first()
-        users_registered.append(user.email)
-        
-    return {'users_registered': users_registered}
+    return {'users_registered': registered_user_emails(db, event.id)}
 
 
 #call this endpoint when an admin user wants to view a user's info + profile
@@ -392,10 +441,7 @@ def admin_get_user(request: schemas.ChangeAdmin, db: Session = Depends(get_sessi
     if not new_user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='New User not found')
     
-    events_registered = []
-    for event_id in new_user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        events_registered.append(event.title)
+    events_registered = registered_event_titles(db, new_user.id)
     
     return {'email': new_user.email,
             'full_name': new_user.full_name,
@@ -431,26 +477,96 @@ def admin_kick_user(request: schemas.KickUser, db: Session = Depends(get_session
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    if new_user.id not in event.users_registered:
+    if not user_is_registered(db, new_user.id, event.id):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='New User not registered for event')
     
-    event.users_registered = [x for x in event.users_registered if x != new_user.id]
-    new_user.events_registered = [x for x in new_user.events_registered if x != event.id]
-    db.commit()
+    unregister(db, new_user.id, event.id) #the seat goes to the first user on the waitlist
+    update_event_recommendations(db, event.id)
     
     return {'message': 'User kicked from event successfully'}
 
 
-#call this endpoint to get a list of all events
-#not expecting any input
-#returning a JSON with a list of all event titles
+#call this endpoint when an admin user wants to find the best-fit volunteers for an event, e.g. one that is under-filled
+#expecting a JSON in the schema of MatchUsers
+#returning a JSON with up to k users not yet registered for the event, best match first, in the form {'users': [{'email': email, 'full_name': full_name, 'score': score}]}
+@app.post('/admin/match_users')
+def match_users(request: schemas.MatchUsers, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == request.email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    event = db.query(models.Event).filter(models.Event.title == request.title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    if request.k <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for k')
+    
+    event_embedding = get_event_embeddings(db, [event])[event.id] #stored vector, only embedded if missing
+    users = get_complete_user_index(db) #in-memory matrix of every user's profile vector
+    registered = {user_id for (user_id,) in db.execute(registered_user_ids(event.id)).all()}
+    matches = users.search(event_embedding, request.k, exclude=registered)
+    
+    details = {row.id: row for row in db.query(models.User.id, models.User.email, models.User.full_name).filter(models.User.id.in_([user_id for user_id, score in matches])).all()}
+    return {'users': [{'email': details[user_id].email, 'full_name': details[user_id].full_name, 'score': score} for user_id, score in matches if user_id in details]}
+
+
+#call this endpoint to get the list of events one page at a time
+#expecting optionally limit (events per page, config.EVENTS_PAGE_SIZE by default), cursor (next_cursor of the previous page), sort ('title' or 'deadline'),
+#upcoming (only events whose registration deadline has not passed) and has_seats (only events that are not full)
+#returning a JSON in the form {'event_titles': [title], 'events': [{'title': title, 'date': date, 'time': time, 'location': location, 'seats_left': n}],
+#'next_cursor': cursor or None on the last page, 'total_estimate': n} -> total_estimate counts every page and is approximate for large results
 @app.get('/event/get_events')
-def get_events(db: Session = Depends(get_session)):
-    events = db.query(models.Event).all()
-    event_titles = [event.title for event in events]
-    return {'event_titles': event_titles}
+def get_events(limit: int = config.EVENTS_PAGE_SIZE, cursor: str = None, sort: str = 'title', upcoming: bool = False, has_seats: bool = False, db: Session = Depends(get_session)):
+    if sort not in EVENT_SORTS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Sort must be one of {", ".join(EVENT_SORTS)}')
+    if limit < 1 or limit > config.EVENTS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Limit must be between 1 and {config.EVENTS_MAX_PAGE_SIZE}')
+    
+    try:
+        rows, next_cursor = get_event_page(db, limit, cursor=cursor, sort=sort, upcoming=upcoming, has_seats=has_seats)
+    except InvalidCursor as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    
+    return {'event_titles': [row.title for row in rows],
+            'events': [{'title': row.title, 'date': row.date, 'time': row.time, 'location': row.location, 'seats_left': max(row.capacity - row.registered_count, 0)} for row in rows],
+            'next_cursor': next_cursor,
+            'total_estimate': count_events(db, upcoming=upcoming, has_seats=has_seats)
+            }
     
 
+#call this endpoint to search events by keywords in their title, description, tasks, requirements and location
+#expecting the search text as q (supports "quoted phrases", or and -excluded words) and optionally limit, cursor (next_cursor of the previous page),
+#upcoming and has_seats as in /event/get_events
+#returning a JSON in the form {'events': [{'title': title, 'date': date, 'time': time, 'location': location, 'seats_left': n, 'rank': rank}],
+#'next_cursor': cursor or None on the last page, 'total_estimate': n} -> best match first
+@app.get('/event/search')
+def search_events_endpoint(q: str, limit: int = config.SEARCH_PAGE_SIZE, cursor: str = None, upcoming: bool = False, has_seats: bool = False, db: Session = Depends(get_session)):
+    if not q.strip():
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Search text is empty')
+    if limit < 1 or limit > config.EVENTS_MAX_PAGE_SIZE:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f'Limit must be between 1 and {config.EVENTS_MAX_PAGE_SIZE}')
+    
+    try:
+        rows, next_cursor, total = search_events(db, q, limit, cursor=cursor, upcoming=upcoming, has_seats=has_seats)
+    except InvalidCursor as error:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(error))
+    
+    return {'events': [{'title': row.title, 'date': row.date, 'time': row.time, 'location': row.location, 'seats_left': max(row.capacity - row.registered_count, 0), 'rank': row.rank} for row in rows],
+            'next_cursor': next_cursor,
+            'total_estimate': total
+            }
+
+
+#call this endpoint to suggest event titles while the user types
+#expecting the typed text as q (at least config.AUTOCOMPLETE_MIN_LENGTH characters, shorter texts get no suggestions)
+#returning a JSON in the form {'titles': [title]} -> titles starting with the text first
+@app.get('/event/autocomplete')
+def autocomplete_events(q: str, db: Session = Depends(get_session)):
+    return {'titles': autocomplete_titles(db, q, config.AUTOCOMPLETE_LIMIT)}
+
+
 #call this endpoint to get the list of events a user is registered for
 #expecting the email of the user as a string
 #returning a JSON with a list of all event titles the user is registered for
@@ -460,19 +576,15 @@ def get_user_events(email: str, db: Session = Depends(get_session)):
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events_registered = []
-    for event_id in user.events_registered:
-        event = db.query(models.Event).filter(models.Event.id == event_id).first()
-        if not event:
-            continue
-        events_registered.append(event.title)
+    events_registered = registered_event_titles(db, user.id)
     
     return {'events_registered': events_registered}
 
 
 #call this endpoint to generate personalized tasks for a user based on an event
+#responses are cached until the event or user changes -> set force_refresh in the request to generate new ones
 #expecting a JSON in the schema of GenerateTasks
-#returning a JSON containing a single string that is the model's response
+#returning a JSON containing a single string that is the model's response, or {'job_id': job_id} to poll with /user/get_task_job if run_async is set
 @app.post('/user/generate_tasks')
 def generate_tasks_llm(request: schemas.GenerateTasks, db: Session = Depends(get_session)):
     event = db.query(models.Event).filter(models.Event.title == request.event_title).first()
@@ -483,33 +595,176 @@ def generate_tasks_llm(request: schemas.GenerateTasks, db: Session = Depends(get
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    event_description = 'Event Description: \n' + event.description + '\n\n' + 'Event Tasks: \n' + event.tasks
-    user_description = 'User Skills: \n' + user.skills + '\n\n' + 'User Interests: \n' + user.interests + '\n\n' + 'User Past Volunteer Experience: \n' + user.past_volunteer_experience
+    if request.run_async: #the model call runs on the worker pool instead of holding a request thread
+        return {'job_id': enqueue_job(db, event, user, force_refresh=request.force_refresh)}
     
-    return {'response': generate_tasks(event_description, user_description)}
+    return {'response': generate_tasks_cached(db, event, user, force_refresh=request.force_refresh)} #cached by prompt, set force_refresh to generate new tasks
 
 
-#call this endpoint to get the top 5 most similar events to a given user's profile
-#expecting the email of the user as a string
-#returning a JSON with a list of the top 5 most similar event titles - will return less than 5 if there are less than 5 events in the database
-@app.get('/user/get_similar_events')
-def match_events(email: str, db: Session = Depends(get_session)):
+#call this endpoint to poll a task generation job queued with run_async
+#expecting the job id as a string
+#returning a JSON in the form {'status': status} where status is 'queued', 'running', 'done' or 'failed', plus 'response' when done or 'error' when failed
+@app.get('/user/get_task_job')
+def get_task_job(job_id: str, db: Session = Depends(get_session)):
+    job = db.get(models.TaskJob, job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Job not found')
+    
+    if job.status == 'done':
+        return {'status': job.status, 'response': job.result}
+    if job.status == 'failed':
+        return {'status': job.status, 'error': job.error}
+    return {'status': job.status}
+
+
+#call this endpoint when an admin user wants personalized tasks generated for every user registered for an event
+#the jobs run on the task worker pool (config.TASK_JOB_WORKERS at once per backend process), failed generations are retried with backoff
+#expecting a JSON in the schema of BulkGenerateTasks
+#returning a JSON in the form {'batch_id': batch_id, 'queued': number of jobs queued} -> poll /admin/get_task_batch for progress, read the results with /admin/get_generated_tasks
+@app.post('/admin/generate_event_tasks')
+def generate_event_tasks(request: schemas.BulkGenerateTasks, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == request.email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    event = db.query(models.Event).filter(models.Event.title == request.title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    
+    registrants = db.query(models.User).filter(models.User.id.in_(registered_user_ids(event.id))).all() #one query for all registrants
+    batch_id, queued = enqueue_event_jobs(db, event, registrants, force_refresh=request.force_refresh)
+    return {'batch_id': batch_id, 'queued': queued}
+
+
+#call this endpoint to follow a bulk task generation started with /admin/generate_event_tasks
+#expecting the email of the admin and the batch id as strings
+#returning a JSON in the form {'total': n, 'queued': n, 'running': n, 'done': n, 'failed': n}
+@app.get('/admin/get_task_batch')
+def get_task_batch(email: str, batch_id: str, db: Session = Depends(get_session)):
     user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    progress = batch_progress(db, batch_id)
+    if progress['total'] == 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Batch not found')
+    return progress
+
+
+#call this endpoint to get the latest generated tasks of every user for an event
+#expecting a JSON in the schema of AdminEvent
+#returning a JSON in the form {'generated_tasks': [{'email': email, 'response': response, 'generated_at': time}]} -> users without generated tasks are left out
+@app.post('/admin/get_generated_tasks')
+def get_generated_tasks(request: schemas.AdminEvent, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == request.email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    
+    event = db.query(models.Event).filter(models.Event.title == request.title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    
+    rows = db.query(models.User.email, models.GeneratedTasks.response, models.GeneratedTasks.generated_at).join(models.GeneratedTasks, models.GeneratedTasks.user_id == models.User.id).filter(models.GeneratedTasks.event_id == event.id).order_by(models.User.email).all()
+    return {'generated_tasks': [{'email': email, 'response': response, 'generated_at': generated_at.isoformat()} for email, response, generated_at in rows]}
+
+
+#streaming version of /user/generate_tasks -> the response is sent as server-sent events while the model writes it
+#expecting a JSON in the schema of GenerateTasks
+#returning a text/event-stream: one 'data' event per piece of the response (JSON-encoded string), then an 'event: done' or 'event: error' message
+@app.post('/user/generate_tasks_stream')
+def generate_tasks_stream(request: schemas.GenerateTasks, db: Session = Depends(get_session)):
+    event = db.query(models.Event).filter(models.Event.title == request.event_title).first()
+    if not event:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
+    
+    user = db.query(models.User).filter(models.User.email == request.user_email).first()
     if not user:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
     
-    events = db.query(models.Event).all()
-    event_descriptions = [event.description for event in events]
-    user_description = user.skills + ' ' + user.interests + ' ' + user.past_volunteer_experience
+    def stream():
+        try:
+            for piece in stream_tasks_cached(event, user, force_refresh=request.force_refresh):
+                yield f'data: {json.dumps(piece)}\n\n'
+            yield 'event: done\ndata: {}\n\n'
+        except Exception as error:
+            yield f'event: error\ndata: {json.dumps(str(error))}\n\n'
     
-    event_embeddings = [get_embeddings(event) for event in event_descriptions]
-    user_embedding = get_embeddings(user_description)
+    return StreamingResponse(stream(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+#call this endpoint to get the top k most similar events to a given user's profile
+#expecting the email of the user as a string, optionally k, the number of events to return (default 5),
+#and optionally mmr_lambda between 0 and 1 to spread the results over different kinds of events (1 = most similar first, the default is config.RECOMMENDATION_MMR_LAMBDA)
+#returning a JSON with a list of the top k most similar event titles, best match first - will return less than k if there are less than k events in the database
+#plus the ranking that produced them in 'source': 'stored', 'live', or a fallback ('stale', 'cached_vectors', 'keyword') when the embedding API is slow or down
+@app.get('/user/get_similar_events')
+def match_events(email: str, k: int = 5, mmr_lambda: float = None, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if k <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for k')
     
-    similarities = [get_cosine_similarity(user_embedding, event_embedding) for event_embedding in event_embeddings]
-    top_5_indices = sorted(range(len(similarities)), key=lambda i: similarities[i], reverse=True)[:5]
-    top_5_events = [events[i].title for i in top_5_indices]
+    mmr_lambda = config.RECOMMENDATION_MMR_LAMBDA if mmr_lambda is None else mmr_lambda
+    if not 0 <= mmr_lambda <= 1:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a value between 0 and 1 for mmr_lambda')
     
-    return {'top_5_events': top_5_events}
+    if mmr_lambda < 1: #rerank a larger pool of the best matches for variety
+        pool, source = get_recommendations(db, user, max(k, config.RECOMMENDATION_MMR_POOL))
+        top_event_ids = diversify(db, user, pool, k, mmr_lambda)
+    else:
+        top_event_ids, source = get_recommendations(db, user, k) #read from the recommendations table, scored live only if the row is missing or stale
+    titles = dict(db.query(models.Event.id, models.Event.title).filter(models.Event.id.in_(top_event_ids)).all())
+    top_events = [titles[event_id] for event_id in top_event_ids if event_id in titles]
+    
+    return {'top_events': top_events, 'source': source}
+
+
+#call this endpoint when an admin user wants the top k events for many users at once (e.g. for outreach)
+#expecting a JSON in the schema of BatchRecommendations -> either a list of user emails, or filters selecting users (no filters means every user)
+#returning JSON Lines, one {'email': email, 'top_events': [titles]} object per user, streamed as users are scored ({'email': email, 'error': message} for unknown emails)
+@app.post('/admin/batch_similar_events')
+def batch_match_events(request: schemas.BatchRecommendations, db: Session = Depends(get_session)):
+    user = db.query(models.User).filter(models.User.email == request.email).first()
+    if not user:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User not found')
+    if not user.is_admin:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='User is not an admin')
+    if request.k <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Please enter a valid value for k')
+    
+    filters = []
+    if request.work_status:
+        filters.append(models.User.work_status.ilike(request.work_status))
+    if request.immigration_status:
+        filters.append(models.User.immigration_status.ilike(request.immigration_status))
+    if request.keyword:
+        filters.append(models.User.skills.ilike(f'%{request.keyword}%') | models.User.interests.ilike(f'%{request.keyword}%'))
+    
+    #the request session is closed once this function returns, so the stream opens its own
+    def stream():
+        stream_db = SessionLocal()
+        try:
+            for result in batch_recommendations(stream_db, request.k, emails=request.user_emails, filters=filters):
+                yield json.dumps(result) + '\n'
+        finally:
+            stream_db.close()
+    
+    return StreamingResponse(stream(), media_type='application/x-ndjson')
+
+
+#call this endpoint to get the counters of the caches in this backend process
+#not expecting any input
+#returning a JSON in the form {'llm_cache': {'hits': hits, 'misses': misses, 'evictions': evictions}, 'single_flight': {...}, 'openai': {'chat': {...}, 'embeddings': {...}, 'embedding_breaker': {...}}, 'queries': {path: {'requests': n, 'queries': n, 'max': n, 'over_budget': n}}}
+@app.get('/metrics')
+def get_metrics():
+    return {'llm_cache': dict(llm_cache_stats), 'single_flight': single_flight_stats(), 'openai': {'chat': chat_scheduler.get_stats(), 'embeddings': embedding_scheduler.get_stats(), 'embedding_breaker': embedding_breaker.get_stats()}, 'queries': query_stats()}
 
 
 #call this endpoint to check if a user is registered for an event
@@ -525,5 +780,5 @@ def is_registered(request: schemas.GenerateTasks, db: Session = Depends(get_sess
     if not event:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Event not found')
     
-    return {'is_registered': user.id in event.users_registered}
+    return {'is_registered': user_is_registered(db, user.id, event.id)}
 
@@ -1,5 +1,7 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ARRAY
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Float, ForeignKey, Index, ARRAY, Computed, text
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from database import Base
+from datetime import datetime
 
 class User(Base): #table to store users - all fields required
     __tablename__ = 'users'
@@ -16,7 +18,8 @@ class User(Base): #table to store users - all fields required
     skills = Column(String, nullable=False) 
     interests = Column(String, nullable=False)
     past_volunteer_experience = Column(String, nullable=False)
-    events_registered = Column(ARRAY(String), default=[]) #stores the ids of the events the user has registered for -> default is empty
+    events_registered = Column(ARRAY(String), default=[]) #legacy list of registered event ids -> replaced by the registrations table, kept in step with it for older versions while config.LEGACY_REGISTRATION_ARRAYS is on
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=text('now()'), index=True) #set by every write, so other processes can catch up their user index (see index_sync.py)
     
 
 class Event(Base): #table to store volunteer events - all fields required
@@ -31,5 +34,109 @@ class Event(Base): #table to store volunteer events - all fields required
     location = Column(String, nullable=False)
     description = Column(String, nullable=False)
     tasks = Column(String, nullable=False)
-    users_registered = Column(ARRAY(String), default=[]) #stores the ids of the users who have registered for the event -> default is empty
-    
\ No newline at end of file
+    users_registered = Column(ARRAY(String), default=[]) #legacy list of registered user ids -> replaced by the registrations table, kept in step with it for older versions while config.LEGACY_REGISTRATION_ARRAYS is on
+    registered_count = Column(Integer, nullable=False, default=0, server_default='0', info={'backfill': 'coalesce(cardinality(users_registered), 0)'}) #number of registrations rows of the event, kept in sync so capacity checks and fullness filters need no COUNT
+    deadline_at = Column(DateTime) #deadline parsed from the free-text deadline, None if it could not be parsed -> see eligibility.py
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow, server_default=text('now()')) #set by every write including seat changes, so other processes can catch up their event indexes (see index_sync.py)
+    #words of the event for /event/search, kept up to date by postgres -> the title weighs most, then the description, then tasks and requirements, then the location
+    search_vector = Column(TSVECTOR, Computed("setweight(to_tsvector('english', coalesce(title, '')), 'A') || setweight(to_tsvector('english', coalesce(description, '')), 'B') || "
+                                              "setweight(to_tsvector('english', coalesce(tasks, '') || ' ' || coalesce(requirements, '')), 'C') || setweight(to_tsvector('english', coalesce(location, '')), 'D')", persisted=True))
+
+    __table_args__ = (
+        Index('ix_events_open', 'deadline_at', postgresql_where=text('registered_count < capacity')), #events that still have seats, by deadline -> loads the event index
+        Index('ix_events_updated_at', 'updated_at'), #events changed since an index was last synced
+        Index('ix_events_title_id', 'title', 'id'), #pages of the event list sorted by title (see event_pages.py)
+        Index('ix_events_deadline_at_id', 'deadline_at', 'id'), #pages of the event list sorted by deadline
+        Index('ix_events_search_vector', 'search_vector', postgresql_using='gin'), #full-text matches of /event/search (see event_search.py)
+        Index('ix_events_title_trgm', 'title', postgresql_using='gin', postgresql_ops={'title': 'gin_trgm_ops'}), #title substrings of /event/autocomplete, needs pg_trgm
+    )
+
+
+class Registration(Base): #one row per user registered for an event -> rows go away with the user or the event
+    __tablename__ = 'registrations'
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True) #the primary key serves the events of a user
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, server_default=text('now()'))
+
+    __table_args__ = (
+        Index('ix_registrations_event_id', 'event_id', 'user_id'), #users of an event
+    )
+
+
+class WaitlistEntry(Base): #users waiting for a seat at a full event -> promoted in order of created_at when a seat frees up
+    __tablename__ = 'waitlist'
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True)
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow, server_default=text('now()'))
+
+    __table_args__ = (
+        Index('ix_waitlist_event_id', 'event_id', 'created_at'), #next user to promote
+    )
+
+
+class EventEmbedding(Base): #table to store the embedding of each event's description -> written on create/update so it is not recomputed per request
+    __tablename__ = 'event_embeddings'
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True) #row is removed together with the event
+    model = Column(String, nullable=False) #name of the embedding model that produced the vector -> a different model means the vector is stale
+    text_hash = Column(String, nullable=False) #hash of the embedded text -> a different hash means the description changed outside the API
+    embedding = Column(ARRAY(Float), nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class ProfileEmbedding(Base): #cache of user profile embeddings -> keyed by content so users with identical profile text share one row
+    __tablename__ = 'profile_embeddings'
+    key = Column(String, primary_key=True) #hash of the embedding model name and the profile text
+    model = Column(String, nullable=False)
+    embedding = Column(ARRAY(Float), nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+
+class Recommendation(Base): #precomputed top-k events per user -> rebuilt by the background job in recommendations.py, read by /user/get_similar_events
+    __tablename__ = 'recommendations'
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    event_ids = Column(ARRAY(String), nullable=False) #best match first
+    scores = Column(ARRAY(Float), nullable=False) #cosine similarity of each event in event_ids
+    computed_at = Column(DateTime, nullable=False) #rows older than config.RECOMMENDATION_TTL_SECONDS are scored again
+    
+    __table_args__ = (Index('ix_recommendations_event_ids', 'event_ids', postgresql_using='gin'),) #finds the users whose list contains an event when it changes or is deleted
+
+
+class LLMResponse(Base): #cache of generate_tasks completions -> keyed by a hash of the rendered prompt and the model parameters, see llm_cache.py
+    __tablename__ = 'llm_responses'
+    key = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), index=True) #entries are dropped when the user or event changes or is deleted
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), index=True)
+    response = Column(String, nullable=False)
+    created_at = Column(DateTime, nullable=False) #entries older than config.LLM_CACHE_TTL_SECONDS are generated again
+    last_used_at = Column(DateTime, nullable=False, index=True) #least recently used entries are evicted first
+
+
+class TaskJob(Base): #queued /user/generate_tasks requests -> run by the worker pool in job_queue.py, kept in the database so they survive a restart
+    __tablename__ = 'task_jobs'
+    id = Column(String, primary_key=True)
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), nullable=False)
+    prompt_key = Column(String, nullable=False) #llm_cache key of the prompt -> a user can only have one queued or running job per prompt
+    force_refresh = Column(Boolean, default=False)
+    status = Column(String, nullable=False) #'queued', 'running', 'done' or 'failed'
+    result = Column(String) #the generated tasks once status is 'done'
+    error = Column(String) #the error message once status is 'failed'
+    lease_expires_at = Column(DateTime) #a running job whose lease expired (its worker died) is picked up again
+    batch_id = Column(String, index=True) #set for jobs queued together by /admin/generate_event_tasks -> used to report progress
+    attempts = Column(Integer, nullable=False, default=0, server_default='0') #failed attempts so far
+    run_after = Column(DateTime) #a job that failed is retried after this time (exponential backoff)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+    
+    __table_args__ = (
+        Index('ix_task_jobs_queue', 'status', 'created_at'), #workers claim the oldest queued job
+        Index('ix_task_jobs_in_flight', 'user_id', 'prompt_key', unique=True, postgresql_where=text("status IN ('queued', 'running')")), #dedupe of identical in-flight jobs
+    )
+
+
+class GeneratedTasks(Base): #latest personalized tasks generated for a user and an event -> written by the task job workers
+    __tablename__ = 'generated_tasks'
+    user_id = Column(String, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    event_id = Column(String, ForeignKey('events.id', ondelete='CASCADE'), primary_key=True, index=True)
+    response = Column(String, nullable=False)
+    generated_at = Column(DateTime, nullable=False)
@@ -1,24 +1,125 @@
-import os
-from openai import OpenAI
+import itertools
+from concurrent.futures import ThreadPoolExecutor
 from langchain_openai import ChatOpenAI 
 from numpy import dot
 from numpy.linalg import norm
+import tiktoken
+import config
+from embedding_providers import get_embedding_provider
+from singleflight import get_flight
+from rate_limiter import Scheduler, current_priority
+from circuit_breaker import CircuitBreaker
 
-openai_api_key = os.environ.get("OPENAI_API_KEY")
+llm = None
 
-embeddings = OpenAI(api_key=openai_api_key)
+#every request to OpenAI is admitted by one of these, see rate_limiter.py
+chat_scheduler = Scheduler(config.OPENAI_CHAT_RPM, config.OPENAI_CHAT_TPM, config.OPENAI_CHAT_MAX_CONCURRENCY)
+embedding_scheduler = Scheduler(config.OPENAI_EMBEDDING_RPM, config.OPENAI_EMBEDDING_TPM, config.OPENAI_EMBEDDING_MAX_CONCURRENCY)
 
-llm = ChatOpenAI(openai_api_key=openai_api_key, model='gpt-3.5-turbo-0125', temperature=0.5)
+#fails embedding calls at once while the API is down, so recommendations fall back instead of waiting on it (see recommendations.get_recommendations)
+embedding_breaker = CircuitBreaker(config.EMBEDDING_BREAKER_FAILURES, config.EMBEDDING_BREAKER_RESET_SECONDS)
 
-def generate_tasks(event_description: str, user_description: str):
+#the chat model is created on first use so the backend can start (and serve recommendations with the local embedding provider) without an API key
+def get_llm() -> ChatOpenAI:
+    global llm
+    if llm is None:
+        llm = ChatOpenAI(openai_api_key=config.OPENAI_API_KEY, model=config.CHAT_MODEL, temperature=config.CHAT_TEMPERATURE, max_retries=0) #retries are done by chat_scheduler
+    return llm
+
+def build_task_prompt(event_description: str, user_description: str) -> str:
     context = 'Here is a description and list of tasks of the volunteering event: \n' + event_description + '\n\n' + "Here is the user's list of skills, description of his interests and past volunteer experiences : " + user_description + '\n\n'
     query = 'Can you generate 3 to 5 personalized tasks for the user that are tailored to the event? Try not to repeat tasks that are already in the event description. Do not use any lists, keep the response in a single paragraph.'
 
-    prompt = context + '\n\n' + query
-    return llm.invoke(prompt).content
+    return context + '\n\n' + query
+
+#tokens a chat request is counted for -> the prompt plus the expected completion
+def chat_tokens(prompt: str) -> int:
+    return count_tokens(prompt) + config.CHAT_COMPLETION_TOKENS
+
+def complete(prompt: str) -> str:
+    return chat_scheduler.call(lambda: get_llm().invoke(prompt).content, chat_tokens(prompt))
+
+#yields the completion piece by piece as the model produces it
+#the request is admitted and retried by chat_scheduler until the first chunk arrives, rate limit errors only happen before it
+def stream_completion(prompt: str):
+    def start():
+        chunks = iter(get_llm().stream(prompt))
+        return next(chunks, None), chunks
+
+    first, chunks = chat_scheduler.call(start, chat_tokens(prompt))
+    for chunk in itertools.chain([first] if first is not None else [], chunks):
+        if chunk.content:
+            yield chunk.content
+
+def generate_tasks(event_description: str, user_description: str):
+    return complete(build_task_prompt(event_description, user_description))
+
+#name of the model behind the configured embedding provider -> stored with every vector to detect stale ones
+def get_embedding_model() -> str:
+    return get_embedding_provider().model_name
 
+embedding_flights = get_flight('embeddings', config.EMBEDDING_FLIGHT_TIMEOUT_SECONDS)
+
+#concurrent requests embedding the same text (a popular event, identical profiles) share one API call
 def get_embeddings(text: str):
-    return embeddings.embeddings.create(input=text, model="text-embedding-3-small").data[0].embedding
+    provider = get_embedding_provider()
+    return embedding_flights.do((provider.model_name, text), lambda: embed(provider, [text])[0])
+
+#sends one embeddings request through embedding_breaker and embedding_scheduler -> in-process providers are called directly
+def embed(provider, texts: list, priority: int = None) -> list:
+    if not provider.requires_network:
+        return provider.embed(texts)
+    tokens = sum(count_tokens(text) for text in texts)
+    return embedding_breaker.call(lambda: embedding_scheduler.call(lambda: provider.embed(texts), tokens, priority))
+
+#encoding used by the text-embedding-3 models -> loaded on first use since tiktoken may download it
+encoding = None
+
+def count_tokens(text: str) -> int:
+    global encoding
+    if encoding is None:
+        encoding = tiktoken.get_encoding('cl100k_base')
+    return len(encoding.encode(text))
+
+#splits the inputs into consecutive chunks of at most max_count texts and max_tokens tokens -> returns lists of input positions
+#a single text over max_tokens still gets a chunk of its own
+def chunk_texts(texts: list, max_count: int, max_tokens: int) -> list:
+    chunks = []
+    current = []
+    current_tokens = 0
+    for i, text in enumerate(texts):
+        tokens = count_tokens(text)
+        if current and (len(current) >= max_count or current_tokens + tokens > max_tokens):
+            chunks.append(current)
+            current = []
+            current_tokens = 0
+        current.append(i)
+        current_tokens += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+#embeds many texts with as few requests as possible -> chunks are sent concurrently, at most config.EMBEDDING_MAX_CONCURRENCY at a time
+#returns one embedding per text, in the same order as the input
+def get_embeddings_batch(texts: list) -> list:
+    if not texts:
+        return []
+
+    provider = get_embedding_provider()
+    if not provider.requires_network: #in-process providers gain nothing from chunking or threads
+        return provider.embed(texts)
+
+    priority = current_priority() #the pool threads do not inherit the caller's priority
+    def embed_chunk(positions):
+        return embed(provider, [texts[i] for i in positions], priority)
+
+    chunks = chunk_texts(texts, config.EMBEDDING_BATCH_SIZE, config.EMBEDDING_BATCH_TOKENS)
+    results = [None] * len(texts)
+    with ThreadPoolExecutor(max_workers=min(config.EMBEDDING_MAX_CONCURRENCY, len(chunks))) as executor:
+        for positions, vectors in zip(chunks, executor.map(embed_chunk, chunks)):
+            for i, vector in zip(positions, vectors):
+                results[i] = vector
+    return results
 
 def get_cosine_similarity(embedding1, embedding2):
-    return dot(embedding1, embedding2)/(norm(embedding1)*norm(embedding2))
\ No newline at end of file
+    return dot(embedding1, embedding2)/(norm(embedding1)*norm(embedding2))
@@ -0,0 +1,34 @@
+import threading
+from sqlalchemy import event
+from database import SessionLocal
+import config
+
+#counts the statements every request sends through its session -> catches endpoints that query once per row (N+1) instead of once per set
+#only statements run through the session are counted (queries, bulk updates/deletes, inserts via db.execute), not the writes of a flush
+
+
+@event.listens_for(SessionLocal, 'do_orm_execute')
+def count_statement(orm_execute_state):
+    info = orm_execute_state.session.info
+    info['queries'] = info.get('queries', 0) + 1
+
+def session_queries(session) -> int:
+    return session.info.get('queries', 0)
+
+
+lock = threading.Lock()
+routes = {} #path -> {'requests': n, 'queries': n, 'max': n, 'over_budget': n}
+
+#adds the statements a request ran to the totals of its route -> requests above config.QUERY_BUDGET are counted in over_budget
+def record_request(path: str, queries: int):
+    with lock:
+        route = routes.setdefault(path, {'requests': 0, 'queries': 0, 'max': 0, 'over_budget': 0})
+        route['requests'] += 1
+        route['queries'] += queries
+        route['max'] = max(route['max'], queries)
+        route['over_budget'] += queries > config.QUERY_BUDGET
+
+#totals per route -> reported by /metrics
+def get_stats() -> dict:
+    with lock:
+        return {path: dict(route) for path, route in routes.items()}
@@ -0,0 +1,143 @@
+import heapq
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+import config
+
+#client-side budgeting of OpenAI traffic -> every chat and embedding request goes through a Scheduler (see openai_llm.py)
+#a request waits until the requests-per-minute and tokens-per-minute budgets allow it, interactive requests are admitted before background ones,
+#and 429s and 5xx errors are retried after the Retry-After delay the API sends, or after an adaptive backoff when it sends none
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+context = threading.local()
+
+def current_priority() -> int:
+    return getattr(context, 'priority', INTERACTIVE)
+
+#marks the OpenAI calls made by this thread inside the block as background work (job workers, periodic rebuilds, cli commands)
+@contextmanager
+def background_priority():
+    previous = current_priority()
+    context.priority = BACKGROUND
+    try:
+        yield
+    finally:
+        context.priority = previous
+
+
+class TokenBucket: #holds up to per_minute units and refills continuously at per_minute units per minute
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.available = per_minute
+        self.updated = time.monotonic()
+
+    #seconds until amount units are available -> an amount above the capacity only waits for a full bucket
+    def wait_time(self, amount: float, now: float) -> float:
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+        amount = min(amount, self.capacity)
+        return 0.0 if self.available >= amount else (amount - self.available) * 60 / self.capacity
+
+    def take(self, amount: float):
+        self.available -= min(amount, self.capacity)
+
+
+#429 (rate limited) and 5xx (overloaded) responses are worth retrying, anything else is raised at once
+def is_retryable(error: Exception) -> bool:
+    status_code = getattr(error, 'status_code', None)
+    return status_code == 429 or (status_code is not None and status_code >= 500)
+
+#seconds the API asked us to wait, or None if the error carries no Retry-After header
+def retry_after(error: Exception):
+    headers = getattr(getattr(error, 'response', None), 'headers', None) or {}
+    for header, scale in (('retry-after-ms', 0.001), ('retry-after', 1.0)):
+        try:
+            return float(headers[header]) * scale
+        except (KeyError, TypeError, ValueError):
+            continue
+    return None
+
+
+class Scheduler:
+    def __init__(self, rpm: int, tpm: int, max_concurrency: int):
+        self.condition = threading.Condition()
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_concurrency = max_concurrency
+        self.in_flight = 0
+        self.waiting = [] #heap of (priority, arrival) tickets -> only the first one may take budget, so background work never overtakes a waiting user
+        self.arrivals = itertools.count()
+        self.paused_until = 0.0 #set after a 429 so every caller waits, not only the one that was rejected
+        self.backoff = 0.0 #doubled on every retryable error without Retry-After, halved on every success
+        self.stats = {'requests': 0, 'rate_limited': 0, 'retries': 0, 'errors': 0}
+
+    #blocks until a request estimated at tokens tokens fits the budgets and a concurrency slot is free
+    def acquire(self, tokens: int, priority: int):
+        with self.condition:
+            ticket = (priority, next(self.arrivals))
+            heapq.heappush(self.waiting, ticket)
+            try:
+                while True:
+                    timeout = None #callers behind the first ticket sleep until it is admitted
+                    if self.waiting[0] == ticket and self.in_flight < self.max_concurrency:
+                        now = time.monotonic()
+                        timeout = max(self.paused_until - now, self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+                        if timeout <= 0:
+                            break
+                    self.condition.wait(timeout)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.in_flight += 1
+            self.stats['requests'] += 1
+            self.condition.notify_all()
+
+    def release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    #pauses the scheduler after a retryable error -> returns nothing, the retry simply waits in acquire again
+    def failed(self, error: Exception):
+        with self.condition:
+            if getattr(error, 'status_code', None) == 429:
+                self.stats['rate_limited'] += 1
+            self.stats['retries'] += 1
+            self.backoff = min(config.OPENAI_MAX_BACKOFF_SECONDS, max(config.OPENAI_BACKOFF_SECONDS, self.backoff * 2))
+            delay = retry_after(error)
+            self.paused_until = max(self.paused_until, time.monotonic() + (self.backoff if delay is None else delay))
+            self.condition.notify_all()
+
+    def succeeded(self):
+        with self.condition:
+            self.backoff = self.backoff / 2 if self.backoff > config.OPENAI_BACKOFF_SECONDS else 0.0
+
+    #runs fn() within the budgets, retrying retryable errors up to config.OPENAI_MAX_RETRIES times
+    #tokens is the estimated number of tokens the request uses, priority defaults to the one set for the calling thread
+    def call(self, fn, tokens: int, priority: int = None):
+        priority = current_priority() if priority is None else priority
+        for attempt in range(config.OPENAI_MAX_RETRIES + 1):
+            self.acquire(tokens, priority)
+            try:
+                result = fn()
+            except Exception as error:
+                if not is_retryable(error) or attempt == config.OPENAI_MAX_RETRIES:
+                    with self.condition:
+                        self.stats['errors'] += 1
+                    raise
+                self.failed(error)
+            else:
+                self.succeeded()
+                return result
+            finally:
+                self.release()
+
+    def get_stats(self) -> dict:
+        with self.condition:
+            return dict(self.stats, waiting=len(self.waiting), in_flight=self.in_flight)
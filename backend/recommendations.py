@@ -0,0 +1,287 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy import select, func, bindparam, or_, String, Float, ARRAY
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import models
+import config
+from database import SessionLocal
+from rate_limiter import background_priority
+from scoring import mmr, normalize, update_top_k
+from embedding_store import get_event_index, get_user_index, get_profile_embedding, get_profile_embeddings, get_cached_event_index, get_cached_event_vectors, get_cached_profile_embedding, profile_text, index_event, add_pending_event
+from lexical_index import get_lexical_index
+from eligibility import eligible_event_ids, joined_by, joined_event_ids, is_open
+from registrations import registered_user_ids
+
+logger = logging.getLogger(__name__)
+
+
+#writes the ranked (event_id, score) lists of many users in one statement, replacing their previous rows
+#rows is a list of (user_id, results) -> does not commit
+def store_recommendations(db: Session, rows: list, computed_at: datetime = None):
+    if not rows:
+        return
+    computed_at = computed_at or datetime.utcnow()
+    statement = insert(models.Recommendation)
+    statement = statement.on_conflict_do_update(index_elements=['user_id'], set_={'event_ids': statement.excluded.event_ids, 'scores': statement.excluded.scores, 'computed_at': statement.excluded.computed_at})
+    db.execute(statement, [{'user_id': user_id, 'event_ids': [event_id for event_id, score in results], 'scores': [score for event_id, score in results], 'computed_at': computed_at} for user_id, results in rows])
+
+def is_fresh(row: models.Recommendation) -> bool:
+    return datetime.utcnow() - row.computed_at < timedelta(seconds=config.RECOMMENDATION_TTL_SECONDS)
+
+#searches the event index for a user, leaving out the events they joined (closed events are not in the index, see embedding_store.py)
+#with config.RECOMMENDATION_CANDIDATES set, only the indexed events that best match the profile by keywords are scored
+def search_user(db: Session, index, user: models.User, embedding, k: int, joined: set) -> list:
+    if config.RECOMMENDATION_CANDIDATES and len(index) - len(joined) > config.RECOMMENDATION_CANDIDATES:
+        matches = [event_id for event_id, score in get_lexical_index(db).search(profile_text(user), config.RECOMMENDATION_CANDIDATES) if event_id in index and event_id not in joined]
+        if len(matches) >= k: #a profile sharing too few words with the catalog is scored against every indexed event
+            return index.search_among(embedding, k, matches)
+    return index.search(embedding, k, exclude=joined)
+
+#scores a single user against the events they can register for and stores the result -> returns the (event_id, score) pairs, best first
+#the only per-user lookup is the user's own registrations; the results are checked once more in SQL, so an event another process closed
+#since this one last synced its index is taken out of the index and the search repeated
+def score_user(db: Session, user: models.User, k: int) -> list:
+    k = max(k, config.RECOMMENDATION_STORE_K)
+    index = get_event_index(db)
+    embedding = get_profile_embedding(db, user)
+
+    joined = joined_by(db, user.id)
+    results = search_user(db, index, user, embedding, k, joined)
+    eligible = eligible_event_ids(db, user, among=[event_id for event_id, score in results])
+    if len(eligible) < len(results):
+        for event_id, score in results:
+            if event_id not in eligible:
+                index.remove(event_id)
+        results = search_user(db, index, user, embedding, k, joined)
+    store_recommendations(db, [(user.id, results)])
+    db.commit()
+    return results
+
+
+#live scorings run here so a request can stop waiting at its deadline -> the scoring still finishes and stores its row for the next visit
+#a scoring is only submitted when a worker is free (live_slots), so nothing queues up behind slow scorings whose callers already fell back
+live_pool = ThreadPoolExecutor(max_workers=config.RECOMMENDATION_LIVE_WORKERS, thread_name_prefix='recommendation-live')
+live_slots = threading.BoundedSemaphore(config.RECOMMENDATION_LIVE_WORKERS)
+
+class LivePoolBusy(Exception):
+    pass
+
+#score_user with its own session, for live_pool -> frees its slot when done
+def score_user_by_id(user_id: str, k: int) -> list:
+    db = SessionLocal()
+    try:
+        return score_user(db, db.get(models.User, user_id), k)
+    finally:
+        db.close()
+        live_slots.release()
+
+#starts a live scoring on a free worker -> raises LivePoolBusy if every worker is taken
+def submit_live_scoring(user_id: str, k: int):
+    if not live_slots.acquire(blocking=False):
+        raise LivePoolBusy(f'All {config.RECOMMENDATION_LIVE_WORKERS} live scoring workers are busy')
+    try:
+        return live_pool.submit(score_user_by_id, user_id, k)
+    except Exception:
+        live_slots.release()
+        raise
+
+
+#returns (ids of the top k events for a user best first, source) where source says which ranking was used:
+#'stored' -> the user's fresh row in the recommendations table, one primary key lookup
+#'live' -> scored now, because the row is missing, stale or has fewer than k events the user can still register for
+#if live scoring fails, misses config.RECOMMENDATION_DEADLINE_SECONDS (embedding API slow, down or its circuit breaker open) or finds every live worker busy, the fallbacks are, in order:
+#'stale' -> the user's row even though it is past its TTL
+#'cached_vectors' -> the stored profile vector against the stored event vectors, no API call
+#'keyword' -> keyword overlap between the profile and the events, for users whose profile was never embedded
+#every source only returns events the user can register for -> stored rows are rechecked since events fill up and deadlines pass after they are written
+def get_recommendations(db: Session, user: models.User, k: int) -> tuple:
+    row = db.get(models.Recommendation, user.id)
+    if row is not None:
+        eligible = eligible_event_ids(db, user, among=row.event_ids)
+        stored = [event_id for event_id in row.event_ids if event_id in eligible][:k]
+        #a row shorter than RECOMMENDATION_STORE_K already held every eligible event when it was computed
+        complete = len(stored) == k or len(row.event_ids) < config.RECOMMENDATION_STORE_K
+        if k <= config.RECOMMENDATION_STORE_K and is_fresh(row) and complete:
+            return stored, 'stored'
+
+    try:
+        results = submit_live_scoring(user.id, k).result(timeout=config.RECOMMENDATION_DEADLINE_SECONDS)
+        return [event_id for event_id, score in results[:k]], 'live'
+    except Exception as error: #includes the deadline's TimeoutError and LivePoolBusy
+        logger.warning('Live recommendations for user %s failed, falling back: %r', user.id, error)
+
+    if row is not None and stored:
+        return stored, 'stale'
+
+    embedding = get_cached_profile_embedding(db, user)
+    if embedding is not None:
+        index = get_cached_event_index(db)
+        if len(index):
+            results = [event_id for event_id, score in index.search(embedding, k, exclude=joined_by(db, user.id))]
+            eligible = eligible_event_ids(db, user, among=results)
+            return [event_id for event_id in results if event_id in eligible], 'cached_vectors'
+
+    return keyword_recommendations(db, user, k), 'keyword'
+
+
+#reorders ranked event ids so that the first k are relevant but not near-duplicates of each other -> see scoring.mmr
+#uses only the cached profile vector and the vectors of the pool (from the event index, or one query if it is not loaded), no API call
+#returns the first k ids unchanged if a vector is missing (e.g. the ranking came from the keyword fallback)
+def diversify(db: Session, user: models.User, event_ids: list, k: int, mmr_lambda: float) -> list:
+    embedding = get_cached_profile_embedding(db, user)
+    if embedding is None:
+        return event_ids[:k]
+    pool = get_cached_event_vectors(db, event_ids)
+    if len(pool) < len(event_ids):
+        return event_ids[:k]
+
+    vectors = normalize([pool[event_id] for event_id in event_ids]) #pool x dim
+    selected = mmr(vectors @ normalize(embedding), vectors @ vectors.T, k, mmr_lambda)
+    return [event_ids[i] for i in selected]
+
+
+#ranks the eligible events by BM25 over their words -> needs no embeddings at all, last fallback of get_recommendations
+#the lexical index holds every event, so the ranking is checked for eligibility 500 events at a time until k are found
+def keyword_recommendations(db: Session, user: models.User, k: int) -> list:
+    index = get_lexical_index(db)
+    ranked = [event_id for event_id, score in index.search(profile_text(user), len(index))]
+    found = []
+    for start in range(0, len(ranked), 500):
+        chunk = ranked[start:start + 500]
+        eligible = eligible_event_ids(db, user, among=chunk)
+        found.extend(event_id for event_id in chunk if event_id in eligible)
+        if len(found) >= k:
+            break
+    return found[:k]
+
+
+#search_many over the indexed events, leaving out for each user the events they joined
+def search_unjoined(db: Session, index, user_ids: list, vectors, k: int) -> list:
+    joined = joined_event_ids(db, user_ids)
+    return index.search_many(vectors, k, exclude_rows=[joined.get(user_id, ()) for user_id in user_ids])
+
+
+#recomputes the stored top-k of every user -> users are scored chunk_size at a time with one matrix product per chunk
+#only events the users can register for are scored, as in score_user
+#returns the number of users that were scored
+def rebuild_recommendations(db: Session, k: int = None, chunk_size: int = None) -> int:
+    k = k or config.RECOMMENDATION_STORE_K
+    chunk_size = chunk_size or config.RECOMMENDATION_CHUNK_SIZE
+    index = get_event_index(db)
+
+    #only the columns that make up the profile text are loaded
+    users = db.query(models.User.id, models.User.skills, models.User.interests, models.User.past_volunteer_experience).all()
+    computed_at = datetime.utcnow()
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        results = search_unjoined(db, index, [user.id for user in chunk], get_profile_embeddings(db, chunk), k)
+        store_recommendations(db, [(user.id, user_results) for user, user_results in zip(chunk, results)], computed_at)
+        db.commit()
+
+    return len(users)
+
+
+#yields {'email': ..., 'top_events': [...]} for every selected user, computing chunk_size users at a time with one users x events matrix product
+#users are either the given emails (unknown ones yield an 'error' entry) or everyone matching filters, paged by id so memory stays bounded
+def batch_recommendations(db: Session, k: int, emails: list = None, filters: list = (), chunk_size: int = None):
+    chunk_size = chunk_size or config.RECOMMENDATION_CHUNK_SIZE
+    index = get_event_index(db)
+    columns = (models.User.id, models.User.email, models.User.skills, models.User.interests, models.User.past_volunteer_experience)
+
+    def chunks():
+        if emails is not None:
+            for start in range(0, len(emails), chunk_size):
+                requested = emails[start:start + chunk_size]
+                found = db.query(*columns).filter(models.User.email.in_(requested)).all()
+                found_emails = {user.email for user in found}
+                yield found, [email for email in requested if email not in found_emails]
+        else:
+            last_id = ''
+            while True:
+                found = db.query(*columns).filter(models.User.id > last_id, *filters).order_by(models.User.id).limit(chunk_size).all()
+                if not found:
+                    return
+                last_id = found[-1].id
+                yield found, []
+
+    for users, unknown in chunks():
+        results = search_unjoined(db, index, [user.id for user in users], get_profile_embeddings(db, users), k) if users else []
+        event_ids = {event_id for user_results in results for event_id, score in user_results}
+        titles = dict(db.query(models.Event.id, models.Event.title).filter(models.Event.id.in_(event_ids)).all())
+
+        for user, user_results in zip(users, results):
+            yield {'email': user.email, 'top_events': [titles[event_id] for event_id, score in user_results if event_id in titles]}
+        for email in unknown:
+            yield {'email': email, 'error': 'User not found'}
+
+
+#keeps the stored lists exact after an event was added to, changed in or removed from the event index, without rescoring every user against
+#every event -> see scoring.update_top_k, which gets the rows that held the event and, while it is in the index, the rows it now beats the last
+#entry of: postgres finds those from one matrix-vector product of the event with all user vectors, leaving out users registered for it
+#rows of users whose profile vector is not cached are deleted instead and scored live on their next visit, then commits
+def update_stored_lists(db: Session, event_id: str):
+    index = get_event_index(db)
+    users = get_user_index(db)
+    rows = {row.user_id: row for row in db.query(models.Recommendation).filter(models.Recommendation.event_ids.contains([event_id])).all()} #GIN index on event_ids
+
+    if event_id in index:
+        user_ids, scores = users.score_all(index.get_vectors([event_id])[0])
+        if user_ids:
+            new_scores = select(func.unnest(bindparam('user_ids', user_ids, type_=ARRAY(String))).label('user_id'), func.unnest(bindparam('scores', scores.tolist(), type_=ARRAY(Float))).label('score')).subquery()
+            length = func.cardinality(models.Recommendation.scores)
+            beaten = db.query(models.Recommendation).join(new_scores, new_scores.c.user_id == models.Recommendation.user_id).filter(or_(length < config.RECOMMENDATION_STORE_K, models.Recommendation.scores[length] < new_scores.c.score), models.Recommendation.user_id.not_in(registered_user_ids(event_id))).all()
+            rows.update((row.user_id, row) for row in beaten)
+
+    lists = {user_id: list(zip(row.event_ids, row.scores)) for user_id, row in rows.items() if user_id in users}
+    if lists:
+        changed = update_top_k(lists, index, users, event_id, config.RECOMMENDATION_STORE_K, joined_event_ids(db, list(lists)), config.RECOMMENDATION_CHUNK_SIZE)
+        store_recommendations(db, list(changed.items()))
+    unknown = [user_id for user_id in rows if user_id not in users]
+    if unknown:
+        db.query(models.Recommendation).filter(models.Recommendation.user_id.in_(unknown)).delete(synchronize_session=False)
+    db.commit()
+
+#puts an event into the event index and the stored lists while users can register for it, and takes it out of both once it filled up, passed
+#its deadline or was deleted -> called after every write that can open or close an event (create, update, delete, register, unregister)
+#embedding is the new vector if the description was just re-embedded; otherwise an event whose state did not change costs one primary key lookup
+def update_event_recommendations(db: Session, event_id: str, embedding: list = None):
+    index = get_cached_event_index(db)
+    event = db.query(models.Event.id, models.Event.registered_count, models.Event.capacity, models.Event.deadline_at).filter(models.Event.id == event_id).first()
+    if event is None or not is_open(event):
+        if event_id in index:
+            index.remove(event_id)
+            update_stored_lists(db, event_id)
+        return
+
+    if embedding is None:
+        if event_id in index:
+            return
+        embedding = get_cached_event_vectors(db, [event_id]).get(event_id)
+        if embedding is None: #never embedded or its description changed -> embedded by the next get_event_index
+            add_pending_event(event_id)
+            return
+    index_event(event_id, embedding, event.deadline_at)
+    update_stored_lists(db, event_id)
+
+
+def refresh_loop():
+    while True:
+        time.sleep(config.RECOMMENDATION_REFRESH_SECONDS) #rows are filled lazily by the endpoint until the first rebuild
+        db = SessionLocal()
+        try:
+            with background_priority():
+                count = rebuild_recommendations(db)
+            logger.info('Rebuilt recommendations for %d users', count)
+        except Exception:
+            logger.exception('Could not rebuild recommendations')
+        finally:
+            db.close()
+
+#starts the periodic rebuild in a daemon thread -> called once when the API starts, does nothing if the interval is 0
+def start_refresh_thread():
+    if config.RECOMMENDATION_REFRESH_SECONDS > 0:
+        threading.Thread(target=refresh_loop, name='recommendation-refresh', daemon=True).start()
@@ -0,0 +1,197 @@
+from sqlalchemy import select, func, update, exists
+from sqlalchemy.orm import Session
+from sqlalchemy.dialects.postgresql import insert
+import models
+import config
+
+
+#titles of the events a user is registered for, in the order they registered -> one query through the primary key of registrations
+def registered_event_titles(db: Session, user_id: str) -> list:
+    rows = db.query(models.Event.title).join(models.Registration, models.Registration.event_id == models.Event.id).filter(models.Registration.user_id == user_id).order_by(models.Registration.created_at).all()
+    return [title for (title,) in rows]
+
+#emails of the users registered for an event, in the order they registered -> one query through ix_registrations_event_id
+def registered_user_emails(db: Session, event_id: str) -> list:
+    rows = db.query(models.User.email).join(models.Registration, models.Registration.user_id == models.User.id).filter(models.Registration.event_id == event_id).order_by(models.Registration.created_at).all()
+    return [email for (email,) in rows]
+
+#subquery of the ids of the users registered for an event, for use in IN filters
+def registered_user_ids(event_id: str):
+    return select(models.Registration.user_id).where(models.Registration.event_id == event_id)
+
+#subquery of the ids of the events a user is registered for, for use in IN filters
+def registered_event_ids(user_id: str):
+    return select(models.Registration.event_id).where(models.Registration.user_id == user_id)
+
+#also true for a registration an older version of the backend only wrote to the legacy array (see mirror_legacy)
+def is_registered(db: Session, user_id: str, event_id: str) -> bool:
+    if db.get(models.Registration, (user_id, event_id)) is not None:
+        return True
+    return config.LEGACY_REGISTRATION_ARRAYS and in_legacy_array(db, user_id, event_id)
+
+
+#while older versions of the backend may still be serving (config.LEGACY_REGISTRATION_ARRAYS), registrations are written to the registrations
+#table and mirrored into the legacy users.events_registered/events.users_registered arrays, which those versions read and write
+#the arrays stay complete, so seats are counted against them too and migrate_registrations can resync the table from them
+
+def in_legacy_array(db: Session, user_id: str, event_id: str) -> bool:
+    return db.query(exists().where(models.Event.id == event_id, models.Event.users_registered.any(user_id))).scalar()
+
+#adds or removes the pair in both legacy arrays -> nothing to do once config.LEGACY_REGISTRATION_ARRAYS is off, does not commit
+def mirror_legacy(db: Session, user_id: str, event_id: str, registered: bool):
+    if not config.LEGACY_REGISTRATION_ARRAYS:
+        return
+    for table, column, row_id, value in ((models.Event, models.Event.users_registered, event_id, user_id), (models.User, models.User.events_registered, user_id, event_id)):
+        without = func.array_remove(column, value)
+        db.execute(update(table).where(table.id == row_id).values({column: func.array_append(without, value) if registered else without}))
+
+
+#seats are allocated with a conditional UPDATE of events.registered_count -> postgres serializes concurrent updates of the row,
+#so however many requests race for the last seat, exactly one sees registered_count < capacity and gets it
+#the registration row is inserted in the same transaction, so a seat is never taken without it
+
+
+#takes one seat of an event if it has one left -> returns False if the event is full, does not commit
+def take_seat(db: Session, event_id: str) -> bool:
+    criteria = [models.Event.id == event_id, models.Event.registered_count < models.Event.capacity]
+    if config.LEGACY_REGISTRATION_ARRAYS: #older versions only append to the array, so their registrations are not in registered_count yet
+        criteria.append(func.coalesce(func.cardinality(models.Event.users_registered), 0) < models.Event.capacity)
+    taken = db.execute(update(models.Event).where(*criteria).values(registered_count=models.Event.registered_count + 1).returning(models.Event.id)).first()
+    return taken is not None
+
+#inserts a registration -> returns False if the user was already registered, does not commit
+def add_registration(db: Session, user_id: str, event_id: str) -> bool:
+    inserted = db.execute(insert(models.Registration).values(user_id=user_id, event_id=event_id).on_conflict_do_nothing().returning(models.Registration.user_id)).first()
+    return inserted is not None
+
+
+#registers a user for an event, or puts them on its waitlist if it is full and join_waitlist is set, and commits
+#returns 'registered', 'waitlisted', 'full', 'already_registered' or 'already_waitlisted'
+def register(db: Session, user_id: str, event_id: str, join_waitlist: bool = False) -> str:
+    if is_registered(db, user_id, event_id):
+        return 'already_registered'
+
+    if take_seat(db, event_id):
+        if not add_registration(db, user_id, event_id): #a concurrent request of the same user won -> give the seat back
+            db.rollback()
+            return 'already_registered'
+        mirror_legacy(db, user_id, event_id, True)
+        db.query(models.WaitlistEntry).filter(models.WaitlistEntry.user_id == user_id, models.WaitlistEntry.event_id == event_id).delete(synchronize_session=False)
+        db.commit()
+        return 'registered'
+
+    db.rollback()
+    if not join_waitlist:
+        return 'full'
+    inserted = db.execute(insert(models.WaitlistEntry).values(user_id=user_id, event_id=event_id).on_conflict_do_nothing().returning(models.WaitlistEntry.user_id)).first()
+    db.commit()
+    return 'waitlisted' if inserted is not None else 'already_waitlisted'
+
+#position of a user on the waitlist of an event, starting at 1 -> None if they are not on it
+def waitlist_position(db: Session, user_id: str, event_id: str):
+    entry = db.get(models.WaitlistEntry, (user_id, event_id))
+    if entry is None:
+        return None
+    return db.query(models.WaitlistEntry).filter(models.WaitlistEntry.event_id == event_id, models.WaitlistEntry.created_at <= entry.created_at).count()
+
+
+#gives one seat of an event back -> does not commit
+def release_seat(db: Session, event_id: str):
+    db.execute(update(models.Event).where(models.Event.id == event_id).values(registered_count=models.Event.registered_count - 1))
+
+#moves users from the waitlist into free seats, oldest entry first -> returns the ids of the promoted users, does not commit
+#entries are locked with SKIP LOCKED so concurrent promotions for the same event never pick the same user
+#also called when an event's capacity is raised
+def promote_waitlist(db: Session, event_id: str) -> list:
+    promoted = []
+    while True:
+        entry = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.event_id == event_id).order_by(models.WaitlistEntry.created_at, models.WaitlistEntry.user_id).with_for_update(skip_locked=True).first()
+        if entry is None or not take_seat(db, event_id):
+            return promoted
+        db.delete(entry)
+        db.flush()
+        if add_registration(db, entry.user_id, event_id):
+            mirror_legacy(db, entry.user_id, event_id, True)
+            promoted.append(entry.user_id)
+        else: #already registered some other way -> the seat goes to the next entry
+            release_seat(db, event_id)
+
+#deletes a registration and passes its seat on to the waitlist -> returns False if there was no registration, does not commit
+def remove_registration(db: Session, user_id: str, event_id: str) -> bool:
+    removed = db.query(models.Registration).filter(models.Registration.user_id == user_id, models.Registration.event_id == event_id).delete(synchronize_session=False)
+    if removed:
+        release_seat(db, event_id)
+    elif not (config.LEGACY_REGISTRATION_ARRAYS and in_legacy_array(db, user_id, event_id)): #one only an older version wrote is in the arrays alone
+        return False
+    mirror_legacy(db, user_id, event_id, False)
+    promote_waitlist(db, event_id)
+    return True
+
+#removes a user from an event, or from its waitlist if they are only waitlisted, and commits
+#returns 'unregistered', 'left_waitlist' or 'not_registered'
+def unregister(db: Session, user_id: str, event_id: str) -> str:
+    if remove_registration(db, user_id, event_id):
+        db.commit()
+        return 'unregistered'
+
+    left = db.query(models.WaitlistEntry).filter(models.WaitlistEntry.user_id == user_id, models.WaitlistEntry.event_id == event_id).delete(synchronize_session=False)
+    db.commit()
+    return 'left_waitlist' if left else 'not_registered'
+
+#removes every registration and waitlist entry of a user that is about to be deleted, passing their seats on -> does not commit
+#returns the ids of the events they were registered for
+def release_user_seats(db: Session, user_id: str):
+    db.query(models.WaitlistEntry).filter(models.WaitlistEntry.user_id == user_id).delete(synchronize_session=False)
+    event_ids = {event_id for (event_id,) in db.query(models.Registration.event_id).filter(models.Registration.user_id == user_id).all()}
+    if config.LEGACY_REGISTRATION_ARRAYS:
+        event_ids |= {event_id for (event_id,) in db.query(models.Event.id).filter(models.Event.users_registered.any(user_id)).all()}
+    for event_id in event_ids:
+        remove_registration(db, user_id, event_id)
+    return list(event_ids)
+
+
+#recomputes registered_count of the given events from the registrations table -> does not commit
+def recount_registrations(db: Session, event_ids: list):
+    count = select(func.count()).select_from(models.Registration).where(models.Registration.event_id == models.Event.id).scalar_subquery()
+    db.query(models.Event).filter(models.Event.id.in_(event_ids)).update({models.Event.registered_count: count}, synchronize_session=False)
+
+
+#brings the registrations table in line with the legacy events.users_registered arrays, which older versions of the backend keep writing
+#while config.LEGACY_REGISTRATION_ARRAYS is on (this version mirrors its own writes into them, and older versions kept both arrays in step)
+#copies the registrations only an older version made and deletes those an older version removed, then recomputes registered_count
+#runs batch_size events per transaction and never empties the arrays, so it can run while old and new versions serve side by side, as often
+#as needed -> the API runs it on start and `python cli.py migrate_registrations` runs it by hand, once more after the last old instance stopped
+#ids of users that no longer exist are dropped -> returns the number of registrations copied
+def migrate_registrations(db: Session, batch_size: int = 1000) -> int:
+    copied = 0
+    last_id = ''
+    while True:
+        rows = db.query(models.Event.id, models.Event.users_registered).filter(models.Event.id > last_id).order_by(models.Event.id).limit(batch_size).with_for_update(of=models.Event).all()
+        if not rows:
+            return copied
+        last_id = rows[-1].id
+        event_ids = [event_id for event_id, user_ids in rows]
+
+        pairs = {(event_id, user_id) for event_id, user_ids in rows for user_id in user_ids or []}
+        existing_users = {user_id for (user_id,) in db.query(models.User.id).filter(models.User.id.in_({user_id for event_id, user_id in pairs})).all()}
+        values = [{'event_id': event_id, 'user_id': user_id} for event_id, user_id in pairs if user_id in existing_users]
+        if values:
+            copied += len(db.execute(insert(models.Registration).values(values).on_conflict_do_nothing().returning(models.Registration.event_id)).all())
+        in_array = exists().where(models.Event.id == models.Registration.event_id, models.Event.users_registered.any(models.Registration.user_id))
+        db.query(models.Registration).filter(models.Registration.event_id.in_(event_ids), ~in_array).delete(synchronize_session=False)
+        recount_registrations(db, event_ids)
+        db.commit()
+
+#empties the legacy arrays once no older version of the backend is left and config.LEGACY_REGISTRATION_ARRAYS was turned off everywhere
+#runs batch_size rows per transaction -> returns the number of users and events cleared
+def clear_legacy_registrations(db: Session, batch_size: int = 1000) -> int:
+    cleared = 0
+    for table, column in ((models.User, models.User.events_registered), (models.Event, models.Event.users_registered)):
+        while True:
+            row_ids = [row_id for (row_id,) in db.query(table.id).filter(func.cardinality(column) > 0).limit(batch_size).all()]
+            if not row_ids:
+                break
+            db.query(table).filter(table.id.in_(row_ids)).update({column: []}, synchronize_session=False)
+            db.commit()
+            cleared += len(row_ids)
+    return cleared
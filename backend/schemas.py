@@ -1,4 +1,5 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class UserCreate(BaseModel): #what data format I expect when user creates an account
     email: str
@@ -45,6 +46,26 @@ class KickUser(BaseModel): #what data format I expect when we kick a user from a
 class GenerateTasks(BaseModel): #what data format I expect when I generate tasks for a user
     user_email: str
     event_title: str
+    force_refresh: bool = False #skip the response cache and generate new tasks
+    run_async: bool = False #queue the generation and return a job id to poll instead of waiting for the response
+
+class BulkGenerateTasks(BaseModel): #what data format I expect when an admin generates tasks for every user registered for an event
+    email: str #email of the admin making the request
+    title: str
+    force_refresh: bool = False #skip the response cache and generate new tasks for everyone
+
+class BatchRecommendations(BaseModel): #what data format I expect when an admin asks for the top events of many users at once
+    email: str #email of the admin making the request
+    user_emails: Optional[list[str]] = None #users to score -> if left out, every user matching the filters below is scored
+    work_status: Optional[str] = None
+    immigration_status: Optional[str] = None
+    keyword: Optional[str] = None #matched case-insensitively against skills and interests
+    k: int = 5
+
+class MatchUsers(BaseModel): #what data format I expect when an admin looks for volunteers for an event
+    email: str #email of the admin making the request
+    title: str
+    k: int = 10
     
 #key is field name, value is list of possible values
 profile_choices = {'gender': ['m', 'f'], 'work_status': ['student', 'employed', 'unemployed'], 'immigration_status': ['citizen', 'pr', 'student visa' , 'other']}
\ No newline at end of file
@@ -0,0 +1,203 @@
+import threading
+import numpy as np
+
+
+#scales vectors to unit length so that cosine similarity becomes a plain dot product
+#works on a single vector or on a matrix with one vector per row
+def normalize(vectors) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1 #all-zero vectors stay zero instead of becoming NaN
+    return vectors / norms
+
+#returns the positions of the k highest scores, highest first
+#argpartition selects them in O(n) and only those k are sorted
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < len(scores):
+        indices = np.argpartition(-scores, k - 1)[:k]
+    else:
+        indices = np.arange(len(scores))
+    return indices[np.argsort(-scores[indices], kind='stable')]
+
+#row-wise version of top_k_indices for a (queries, items) score matrix -> one row of k positions per query, highest first
+def top_k_indices_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        indices = np.broadcast_to(np.arange(scores.shape[1]), scores.shape)
+    order = np.argsort(-np.take_along_axis(scores, indices, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(indices, order, axis=1)
+
+#maximal marginal relevance -> picks k positions one at a time, each maximizing
+#mmr_lambda * relevance - (1 - mmr_lambda) * (highest similarity to an already picked item)
+#relevance has one score per candidate, similarities is the (candidates, candidates) matrix of their pairwise cosine similarities
+#mmr_lambda = 1 is the plain relevance order, lower values trade relevance for variety
+def mmr(relevance: np.ndarray, similarities: np.ndarray, k: int, mmr_lambda: float) -> list:
+    k = min(k, len(relevance))
+    if k <= 0:
+        return []
+    selected = [int(np.argmax(relevance))]
+    picked = np.zeros(len(relevance), dtype=bool)
+    picked[selected[0]] = True
+    max_similarity = similarities[selected[0]].copy()
+    for _ in range(k - 1):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[picked] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        picked[best] = True
+        np.maximum(max_similarity, similarities[best], out=max_similarity)
+    return selected
+
+
+class VectorIndex: #in-memory matrix of pre-normalized vectors, one row per id -> exact cosine top-k with a single matrix-vector product
+    def __init__(self):
+        self.lock = threading.Lock() #endpoints run in FastAPI's threadpool, so reads and writes can overlap
+        self.loaded = False #set once the index has been filled from the database
+        self.clear()
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, id):
+        return id in self.positions
+
+    def clear(self):
+        self.ids = []
+        self.positions = {} #id -> row of self.data
+        self.data = np.empty((0, 0), dtype=np.float32) #rows past self.size are spare capacity
+        self.size = 0
+
+    #replaces the whole content of the index
+    def build(self, ids: list, vectors):
+        with self.lock:
+            self.clear()
+            if ids:
+                self.data = normalize(vectors)
+                self.ids = list(ids)
+                self.positions = {id: i for i, id in enumerate(self.ids)}
+                self.size = len(self.ids)
+            self.loaded = True
+
+    #adds a vector or overwrites the vector of an existing id
+    def upsert(self, id, vector):
+        vector = normalize(vector)
+        with self.lock:
+            if self.size and vector.shape[0] != self.data.shape[1]:
+                raise ValueError(f'Vector has {vector.shape[0]} dimensions, index has {self.data.shape[1]}')
+
+            if id in self.positions:
+                self.data[self.positions[id]] = vector
+                return
+
+            if self.size == self.data.shape[0]: #grow by doubling so repeated inserts stay amortized O(1)
+                grown = np.empty((max(2 * self.size, 16), vector.shape[0]), dtype=np.float32)
+                if self.size:
+                    grown[:self.size] = self.data[:self.size]
+                self.data = grown
+            self.data[self.size] = vector
+            self.ids.append(id)
+            self.positions[id] = self.size
+            self.size += 1
+
+    #removes an id by moving the last row into its place
+    def remove(self, id):
+        with self.lock:
+            position = self.positions.pop(id, None)
+            if position is None:
+                return
+            last = self.size - 1
+            if position != last:
+                self.data[position] = self.data[last]
+                self.ids[position] = self.ids[last]
+                self.positions[self.ids[position]] = position
+            self.ids.pop()
+            self.size -= 1
+
+    #returns up to k (id, score) pairs with the highest cosine similarity to the vector, best first
+    #ids in exclude are never returned
+    def search(self, vector, k: int, exclude=()) -> list:
+        vector = normalize(vector)
+        with self.lock:
+            if self.size == 0:
+                return []
+            scores = self.data[:self.size] @ vector
+            excluded = [self.positions[id] for id in exclude if id in self.positions]
+            if excluded:
+                scores[excluded] = -np.inf
+                k = min(k, self.size - len(excluded))
+            indices = top_k_indices(scores, k)
+            return [(self.ids[i], float(scores[i])) for i in indices]
+
+    #like search, but only the given ids are scored -> ids that are not in the index are skipped
+    def search_among(self, vector, k: int, ids: list) -> list:
+        vector = normalize(vector)
+        with self.lock:
+            candidates = [id for id in ids if id in self.positions]
+            if not candidates:
+                return []
+            scores = self.data[[self.positions[id] for id in candidates]] @ vector
+            return [(candidates[i], float(scores[i])) for i in top_k_indices(scores, k)]
+
+    #cosine similarity of the vector with every row -> returns the ids and a numpy array of scores in the same order
+    def score_all(self, vector) -> tuple:
+        vector = normalize(vector)
+        with self.lock:
+            return list(self.ids[:self.size]), self.data[:self.size] @ vector
+
+    #stored (normalized) vectors of the given ids, one row per id
+    def get_vectors(self, ids: list) -> np.ndarray:
+        with self.lock:
+            return self.data[[self.positions[id] for id in ids]]
+
+    #search for many query vectors with one matrix-matrix product -> returns one list of (id, score) pairs per query
+    #the score matrix is queries x ids, so callers bound memory by passing queries in chunks
+    #exclude_rows optionally holds one collection of ids per query that are never returned for it
+    def search_many(self, vectors, k: int, exclude_rows: list = None) -> list:
+        vectors = normalize(vectors)
+        with self.lock:
+            if self.size == 0:
+                return [[] for _ in range(len(vectors))]
+            scores = vectors @ self.data[:self.size].T
+            for row, row_exclude in enumerate(exclude_rows or ()):
+                row_excluded = [self.positions[id] for id in row_exclude if id in self.positions]
+                if row_excluded:
+                    scores[row, row_excluded] = -np.inf
+            indices = top_k_indices_rows(scores, k)
+            return [[(self.ids[i], float(row_scores[i])) for i in row if row_scores[i] > -np.inf] for row, row_scores in zip(indices, scores)]
+
+
+#the stored top-k lists that change when event_id was added to, updated in or removed from the event index, without rescoring every user
+#against every event -> lists is {user_id: [(event_id, score), ...] best first}, events the (already updated) event index, users an index
+#holding the profile vector of every user in lists, excluded optionally {user_id: event ids never recommended to them}
+#lists that held the event are recomputed with search_many, chunk_size users at a time, since its new score may push it out or it is gone
+#every other list only gets the event merged in if it beats the last entry or the list is shorter than k; lists stored for a larger k keep their length
+#returns {user_id: new list} for the lists that changed -> the result equals search_many over the same vectors
+def update_top_k(lists: dict, events, users, event_id, k: int, excluded: dict = None, chunk_size: int = 256) -> dict:
+    excluded = excluded or {}
+    holders = [user_id for user_id, ranked in lists.items() if any(ranked_id == event_id for ranked_id, score in ranked)]
+    changed = {}
+    for start in range(0, len(holders), chunk_size):
+        chunk = holders[start:start + chunk_size]
+        changed.update(zip(chunk, events.search_many(users.get_vectors(chunk), k, exclude_rows=[excluded.get(user_id, ()) for user_id in chunk])))
+
+    if event_id not in events:
+        return changed
+    others = [user_id for user_id in lists if user_id not in changed and event_id not in excluded.get(user_id, ())]
+    if not others:
+        return changed
+    scores = users.get_vectors(others) @ events.get_vectors([event_id])[0]
+    for user_id, score in zip(others, scores.tolist()):
+        ranked = lists[user_id]
+        length = max(len(ranked), k)
+        if len(ranked) >= length and score <= ranked[-1][1]:
+            continue
+        merged = sorted(ranked + [(event_id, score)], key=lambda pair: pair[1], reverse=True)
+        changed[user_id] = merged[:length]
+    return changed
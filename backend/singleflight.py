@@ -0,0 +1,72 @@
+import threading
+import time
+
+#request coalescing -> concurrent calls with the same key share one in-flight upstream call and all get its result (or its error)
+#only calls that overlap are coalesced, nothing is cached once the call returns
+
+
+class Call: #one in-flight call, waited on by every caller that joined it
+    def __init__(self):
+        self.done = threading.Event()
+        self.started = time.monotonic()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, timeout: float):
+        self.timeout = timeout #callers wait at most this long for a call they joined, and a call running longer is no longer joined
+        self.lock = threading.Lock()
+        self.calls = {} #key -> Call
+        self.stats = {'calls': 0, 'coalesced': 0, 'timeouts': 0}
+
+    #runs fn() unless a call with the same key is already in flight, in which case its result is returned instead
+    #raises TimeoutError if the joined call does not finish within the timeout
+    def do(self, key, fn):
+        with self.lock:
+            self.stats['calls'] += 1
+            call = self.calls.get(key)
+            #a call stuck past its timeout is left to finish on its own and a fresh one is started
+            leader = call is None or time.monotonic() - call.started > self.timeout
+            if leader:
+                call = Call()
+                self.calls[key] = call
+            else:
+                self.stats['coalesced'] += 1
+
+        if leader:
+            try:
+                call.result = fn()
+                return call.result
+            except Exception as error:
+                call.error = error
+                raise
+            finally:
+                with self.lock:
+                    if self.calls.get(key) is call:
+                        del self.calls[key]
+                call.done.set()
+
+        if not call.done.wait(self.timeout - (time.monotonic() - call.started)):
+            with self.lock:
+                self.stats['timeouts'] += 1
+            raise TimeoutError(f'Timed out waiting for an identical call in flight for {self.timeout} seconds')
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+
+flights = {} #name -> SingleFlight, so /metrics can report every group
+
+def get_flight(name: str, timeout: float) -> SingleFlight:
+    if name not in flights:
+        flights[name] = SingleFlight(timeout)
+    return flights[name]
+
+#counters of every group -> reported by /metrics
+def get_stats() -> dict:
+    stats = {}
+    for name, flight in flights.items():
+        with flight.lock:
+            stats[name] = dict(flight.stats, in_flight=len(flight.calls))
+    return stats
@@ -0,0 +1,132 @@
+#concurrency stress test of event registration -> run from the backend directory with `python stress_registration.py`
+#fires hundreds of simultaneous signups at one event and checks that it is never overbooked, that the seat counter matches the
+#registrations table, and that seats freed by unregistering go to the waitlist in order
+#by default it calls the registration functions directly (on a throwaway event and users it deletes afterwards); all requests start at once
+#and share --connections database connections, which must stay below the server's max_connections (100 on a stock postgres)
+#with --url it sends the requests to a running API instead
+import argparse
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+#runs fn(i) for every i at the same moment from count threads -> returns the results in order
+def run_at_once(fn, count: int) -> list:
+    barrier = threading.Barrier(count)
+    def start(i):
+        barrier.wait()
+        return fn(i)
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(start, range(count)))
+
+def check(condition: bool, message: str):
+    print(f'  {"ok  " if condition else "FAIL"} {message}')
+    if not condition:
+        raise SystemExit(1)
+
+
+def stress_database(args):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    import models
+    from database import DB_URL
+    from registrations import register, unregister
+
+    #requests beyond the pool wait for a connection, so every connection stays busy with a competing signup until the last one is done
+    engine = create_engine(DB_URL, pool_size=min(args.connections, args.requests), max_overflow=0, pool_timeout=120)
+    Session = sessionmaker(bind=engine, expire_on_commit=False)
+    run = uuid.uuid4().hex[:8]
+
+    with Session() as db:
+        event = models.Event(id=str(uuid.uuid4()), title=f'stress-{run}', date='', time='', requirements='', capacity=args.capacity, deadline='', location='', description='', tasks='')
+        users = [models.User(id=str(uuid.uuid4()), email=f'stress-{run}-{i}@example.com', full_name='', password='', age=1, gender='m', phone_number='', work_status='student', immigration_status='citizen', skills='', interests='', past_volunteer_experience='') for i in range(args.requests)]
+        db.add(event)
+        db.add_all(users)
+        db.commit()
+
+    def signup(i):
+        with Session() as db:
+            return register(db, users[i].id, event.id, join_waitlist=True)
+
+    def leave(user_id):
+        with Session() as db:
+            return unregister(db, user_id, event.id)
+
+    def state():
+        with Session() as db:
+            count = db.get(models.Event, event.id).registered_count
+            registered = [user_id for (user_id,) in db.query(models.Registration.user_id).filter(models.Registration.event_id == event.id).all()]
+            waitlist = [user_id for (user_id,) in db.query(models.WaitlistEntry.user_id).filter(models.WaitlistEntry.event_id == event.id).order_by(models.WaitlistEntry.created_at, models.WaitlistEntry.user_id).all()]
+            return count, registered, waitlist
+
+    try:
+        print(f'{args.requests} simultaneous signups over {min(args.connections, args.requests)} connections for an event with {args.capacity} seats')
+        results = run_at_once(signup, args.requests)
+        count, registered, waitlist = state()
+        check(results.count('registered') == min(args.capacity, args.requests), f'{results.count("registered")} signups got a seat')
+        check(len(registered) == count == min(args.capacity, args.requests), f'{len(registered)} registrations, seat counter at {count}')
+        check(len(waitlist) == results.count('waitlisted') == args.requests - len(registered), f'{len(waitlist)} users on the waitlist')
+
+        leaving = registered[:args.unregister]
+        print(f'{len(leaving)} simultaneous unregistrations')
+        run_at_once(lambda i: leave(leaving[i]), len(leaving))
+        count, registered_after, waitlist_after = state()
+        promoted = len(waitlist) - len(waitlist_after)
+        check(len(registered_after) == count <= args.capacity, f'{len(registered_after)} registrations, seat counter at {count}')
+        check(promoted == min(len(leaving), len(waitlist)), f'{promoted} users promoted from the waitlist')
+        check(set(waitlist[:promoted]) <= set(registered_after) and waitlist_after == waitlist[promoted:], 'the oldest waitlist entries were promoted')
+    finally:
+        with Session() as db:
+            db.query(models.Event).filter(models.Event.id == event.id).delete(synchronize_session=False)
+            db.query(models.User).filter(models.User.id.in_([user.id for user in users])).delete(synchronize_session=False)
+            db.commit()
+
+
+def stress_api(args):
+    run = uuid.uuid4().hex[:8]
+    emails = [f'stress-{run}-{i}@example.com' for i in range(args.requests)]
+    for email in emails:
+        requests.post(f'{args.url}/register', json={'email': email, 'full_name': 'Stress Test', 'password': 'stress', 'age': 20, 'gender': 'm', 'phone_number': '0', 'work_status': 'student', 'immigration_status': 'citizen', 'skills': '', 'interests': '', 'past_volunteer_experience': ''}).raise_for_status()
+
+    def registered_emails():
+        response = requests.post(f'{args.url}/event/get_users_registered', json={'email': args.admin_email, 'title': args.title})
+        response.raise_for_status()
+        return response.json()['users_registered']
+
+    try:
+        before = len(registered_emails())
+        print(f'{args.requests} simultaneous signups for "{args.title}" ({before} users registered already)')
+        results = run_at_once(lambda i: requests.post(f'{args.url}/event/register_event', params={'email': emails[i], 'title': args.title, 'waitlist': 'true'}).json(), args.requests)
+        seated = [email for email, result in zip(emails, results) if result.get('message') == 'User registered for event successfully']
+        after = registered_emails()
+        check(len(after) == before + len(seated), f'{len(seated)} signups got a seat, {len(after)} users registered')
+        check(len(set(after)) == len(after), 'no user registered twice')
+        if args.capacity is not None:
+            check(len(after) <= args.capacity, f'the event is not overbooked ({len(after)} of {args.capacity} seats)')
+    finally:
+        for email in emails:
+            requests.post(f'{args.url}/user/delete_user', params={'email': email})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that simultaneous registrations never overbook an event')
+    parser.add_argument('--requests', type=int, default=300, help='simultaneous signups')
+    parser.add_argument('--capacity', type=int, default=50, help='seats of the test event (with --url, the capacity of the existing event to check against)')
+    parser.add_argument('--connections', type=int, default=50, help='database connections shared by the requests, keep below max_connections of the server minus what else is connected')
+    parser.add_argument('--unregister', type=int, default=20, help='registered users that leave at once to test waitlist promotion')
+    parser.add_argument('--url', help='base url of a running API, e.g. http://localhost:8000 -> needs --title and --admin-email')
+    parser.add_argument('--title', help='existing event to sign up for with --url')
+    parser.add_argument('--admin-email', help='admin used to list the registrations with --url')
+    args = parser.parse_args()
+
+    if args.url:
+        if not args.title or not args.admin_email:
+            parser.error('--url needs --title and --admin-email')
+        stress_api(args)
+    else:
+        stress_database(args)
+
+
+if __name__ == '__main__':
+    main()
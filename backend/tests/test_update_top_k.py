@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+from scoring import VectorIndex, update_top_k
+
+#the stored lists kept up to date by update_top_k must always equal a full search_many over the same vectors
+
+
+DIM = 16
+K = 10
+
+
+def random_vectors(rng, count: int) -> np.ndarray:
+    return rng.normal(size=(count, DIM)).astype(np.float32)
+
+def full_search(events: VectorIndex, users: VectorIndex, excluded: dict) -> dict:
+    user_ids = list(users.ids)
+    return dict(zip(user_ids, events.search_many(users.get_vectors(user_ids), K, exclude_rows=[excluded.get(user_id, ()) for user_id in user_ids])))
+
+def apply(lists: dict, events: VectorIndex, users: VectorIndex, event_id: str, excluded: dict, chunk_size: int = 256):
+    lists.update(update_top_k(lists, events, users, event_id, K, excluded, chunk_size))
+
+def assert_same(lists: dict, expected: dict):
+    assert lists.keys() == expected.keys()
+    for user_id, results in expected.items():
+        assert [event_id for event_id, score in lists[user_id]] == [event_id for event_id, score in results], user_id
+        assert [score for event_id, score in lists[user_id]] == pytest.approx([score for event_id, score in results], abs=1e-5)
+
+
+@pytest.fixture
+def catalog():
+    rng = np.random.default_rng(7)
+    events = VectorIndex()
+    events.build([f'e{i}' for i in range(200)], random_vectors(rng, 200))
+    users = VectorIndex()
+    users.build([f'u{i}' for i in range(60)], random_vectors(rng, 60))
+    excluded = {f'u{i}': {f'e{j}' for j in rng.choice(200, size=5, replace=False)} for i in range(0, 60, 3)} #every third user joined 5 events
+    return rng, events, users, excluded
+
+
+def test_create_update_delete_sequence(catalog):
+    rng, events, users, excluded = catalog
+    lists = full_search(events, users, excluded)
+
+    for step in range(150):
+        action = rng.choice(['create', 'update', 'delete'])
+        if action == 'create' or len(events) < K + 1:
+            event_id = f'new{step}'
+            events.upsert(event_id, random_vectors(rng, 1)[0])
+        elif action == 'update':
+            event_id = events.ids[rng.integers(len(events))]
+            events.upsert(event_id, random_vectors(rng, 1)[0])
+        else:
+            event_id = events.ids[rng.integers(len(events))]
+            events.remove(event_id)
+        apply(lists, events, users, event_id, excluded, chunk_size=7)
+        assert_same(lists, full_search(events, users, excluded))
+
+def test_update_moving_an_event_to_the_top_of_every_list(catalog):
+    rng, events, users, excluded = catalog
+    lists = full_search(events, users, excluded)
+    event_id = events.ids[0]
+    events.upsert(event_id, users.get_vectors(list(users.ids)).mean(axis=0)) #close to every user
+    apply(lists, events, users, event_id, excluded)
+    assert_same(lists, full_search(events, users, excluded))
+
+def test_lists_shorter_than_k_grow_as_events_are_created():
+    rng = np.random.default_rng(1)
+    events = VectorIndex()
+    events.build([f'e{i}' for i in range(3)], random_vectors(rng, 3))
+    users = VectorIndex()
+    users.build([f'u{i}' for i in range(5)], random_vectors(rng, 5))
+    lists = full_search(events, users, {})
+    assert all(len(results) == 3 for results in lists.values())
+
+    for i in range(3, 15):
+        events.upsert(f'e{i}', random_vectors(rng, 1)[0])
+        apply(lists, events, users, f'e{i}', {})
+        assert_same(lists, full_search(events, users, {}))
+
+def test_excluded_event_is_never_merged(catalog):
+    rng, events, users, excluded = catalog
+    lists = full_search(events, users, excluded)
+    events.upsert('joined', users.get_vectors(['u0'])[0]) #the best possible match for u0, who already joined it
+    excluded['u0'] = excluded['u0'] | {'joined'}
+    apply(lists, events, users, 'joined', excluded)
+    assert 'joined' not in [event_id for event_id, score in lists['u0']]
+    assert_same(lists, full_search(events, users, excluded))
+
+def test_event_outside_the_index_is_only_removed():
+    rng = np.random.default_rng(2)
+    events = VectorIndex()
+    events.build([f'e{i}' for i in range(30)], random_vectors(rng, 30))
+    users = VectorIndex()
+    users.build(['u0', 'u1'], random_vectors(rng, 2))
+    lists = full_search(events, users, {})
+    closed = lists['u0'][0][0]
+    events.remove(closed) #e.g. the event filled up
+    changed = update_top_k(lists, events, users, closed, K)
+    assert set(changed) == {user_id for user_id, results in lists.items() if closed in [event_id for event_id, score in results]}
+    lists.update(changed)
+    assert_same(lists, full_search(events, users, {}))
@@ -1,4 +1,6 @@
 from passlib.context import CryptContext
+from sqlalchemy import inspect, text
+from sqlalchemy.schema import CreateColumn
 from database import Base, engine
 
 password_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -11,4 +13,30 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 
 def reset_db():
     Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+
+#creates missing tables, then adds any column or index that was added to models.py after its table was first created
+#create_all on its own never alters an existing table -> columns added this way must be nullable or have a server default
+#a column can set info={'backfill': sql} to fill existing rows from other columns once it is added
+#the postgres extensions in EXTENSIONS are created first since indexes depend on them, indexes in DROPPED_INDEXES were removed from models.py
+EXTENSIONS = ('pg_trgm',) #trigram index of event titles
+DROPPED_INDEXES = ('ix_events_full',) #full events are no longer looked up, they are kept out of the event index instead
+
+def ensure_schema():
+    with engine.begin() as connection:
+        for extension in EXTENSIONS:
+            connection.execute(text(f'CREATE EXTENSION IF NOT EXISTS {extension}'))
+    Base.metadata.create_all(bind=engine)
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing_columns:
+                    connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}'))
+                    if 'backfill' in column.info:
+                        connection.execute(text(f'UPDATE {table.name} SET {column.name} = {column.info["backfill"]}'))
+            for index in table.indexes:
+                index.create(bind=connection, checkfirst=True)
+        for index in DROPPED_INDEXES:
+            connection.execute(text(f'DROP INDEX IF EXISTS {index}'))
@@ -3,6 +3,9 @@ from . import views
 
 urlpatterns = [
     path("", views.index, name="index"),
+    path("events", views.events_page, name="events_page"),
+    path("search", views.search, name="search"),
+    path("event_autocomplete", views.event_autocomplete, name="event_autocomplete"),
     
     path('login', views.login_view, name='login'),
     path("logout", views.logout_view, name="logout"),
@@ -14,6 +17,7 @@ urlpatterns = [
     path("event_delete/<str:event_title>", views.event_delete, name="event_delete"),
     path("eventreg/<str:event_title>", views.event_reg, name="event_reg"),
     path("eventunreg/<str:event_title>", views.event_unreg, name="event_unreg"),
+    path("event_tasks/<str:event_title>", views.event_tasks_stream, name="event_tasks_stream"),
 
     path("user/<str:user_email>", views.get_user, name="user"),
     path("user_edit/<str:user_email>", views.user_edit, name="user_edit"),
@@ -1,6 +1,6 @@
 from django.contrib.auth import authenticate, login, logout
 from django.db import IntegrityError
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
 from django.urls import reverse
 import requests
@@ -8,9 +8,23 @@ import requests
 from datetime import datetime
 
 FASTAPI_BASE_URL = "http://localhost:8000"
+RECOMMENDATIONS_TIMEOUT = 5 #seconds -> the home page renders without recommendations rather than waiting on a slow backend
+EVENT_SORTS = ("title", "deadline")
 
 #################################################################################################
 
+def event_list_params(request):
+    """
+    Sort and filters of the event list chosen on the home page, in the form /event/get_events expects them
+    """
+
+    sort = request.GET.get("sort", "title")
+    return {
+        "sort": sort if sort in EVENT_SORTS else "title",
+        "upcoming": request.GET.get("upcoming") == "1",
+        "has_seats": request.GET.get("has_seats") == "1",
+    }
+
 def index(request):
     user_email = request.COOKIES.get("user_email", "None")
 
@@ -25,10 +39,14 @@ def index(request):
             params={"email": user_email}
         ).json()["is_admin"]
 
-        recomms = requests.get(
-            f"{FASTAPI_BASE_URL}/user/get_similar_events", 
-            params={"email": user_email}
-        ).json()["top_5_events"]
+        try:
+            recomms = requests.get(
+                f"{FASTAPI_BASE_URL}/user/get_similar_events", 
+                params={"email": user_email},
+                timeout=RECOMMENDATIONS_TIMEOUT
+            ).json()["top_events"]
+        except (requests.RequestException, KeyError, ValueError):
+            recomms = []
 
         registered = requests.get(
             f"{FASTAPI_BASE_URL}/user/get_user_events", 
@@ -40,13 +58,21 @@ def index(request):
             params={"email": user_email}
         ).json()["full_name"]
 
+    # only the first page is rendered here, the page fetches the next ones from events_page as the list is scrolled
+    event_params = event_list_params(request)
+    events_page = requests.get(
+                        f"{FASTAPI_BASE_URL}/event/get_events", 
+                        params=event_params
+                    ).json()
+
     response = render(request, "index.html",{
         "username": username,
         "user_email": user_email,
         "admin_status": admin_status,
-        "events": requests.get(
-                        f"{FASTAPI_BASE_URL}/event/get_events", 
-                    ).json()["event_titles"],
+        "events": events_page["events"],
+        "events_next_cursor": events_page["next_cursor"],
+        "events_total": events_page["total_estimate"],
+        "event_params": event_params,
         "registered": registered,
         "recomms": recomms,
     })
@@ -55,6 +81,52 @@ def index(request):
 
     return response
 
+def search(request):
+    """
+    Events matching the search box of the home page, best match first, one page at a time
+    """
+
+    query = request.GET.get("q", "").strip()
+    if not query:
+        return HttpResponseRedirect(reverse("index"))
+
+    page = requests.get(
+                f"{FASTAPI_BASE_URL}/event/search", 
+                params={"q": query, "cursor": request.GET.get("cursor")}
+            ).json()
+
+    return render(request, "search.html", {
+        "query": query,
+        "events": page.get("events", []),
+        "next_cursor": page.get("next_cursor"),
+        "total": page.get("total_estimate"),
+    })
+
+def event_autocomplete(request):
+    """
+    Titles suggested while typing in the search box, in the list format jQuery UI autocomplete expects
+    """
+
+    titles = requests.get(
+                f"{FASTAPI_BASE_URL}/event/autocomplete", 
+                params={"q": request.GET.get("term", "")}
+            ).json()["titles"]
+    return JsonResponse(titles, safe=False)
+
+def events_page(request):
+    """
+    Next page of the home page event list, after the cursor given by the previous page
+    """
+
+    fastapi_response = requests.get(
+                            f"{FASTAPI_BASE_URL}/event/get_events", 
+                            params={**event_list_params(request), "cursor": request.GET.get("cursor")}
+                        )
+    page = fastapi_response.json()
+    if fastapi_response.status_code != 200:
+        return JsonResponse({"error": page.get("detail", "Could not load events")}, status=400)
+    return JsonResponse({"events": page["events"], "next_cursor": page["next_cursor"]})
+
 #################################################################################################
 
 def login_view(request):
@@ -338,6 +410,32 @@ def event_reg(request, event_title):
         "registered_status": register_event_status,
     })
 
+def event_tasks_stream(request, event_title):
+    """
+    Relays the personalized task stream of the backend to the browser as server-sent events
+    """
+
+    user_email = request.COOKIES.get("user_email", "None")
+
+    fastapi_response = requests.post(
+                            f"{FASTAPI_BASE_URL}/user/generate_tasks_stream", 
+                            json={
+                                "user_email": user_email,
+                                "event_title": event_title,
+                                "force_refresh": request.GET.get("refresh") == "1",
+                            },
+                            stream=True
+                        )
+
+    # chunk_size=None passes every chunk on as soon as it arrives instead of waiting to fill a buffer
+    response = StreamingHttpResponse(
+        fastapi_response.iter_content(chunk_size=None), 
+        content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
 def event_unreg(request, event_title):
     fastapi_response  = requests.post(
                             f"{FASTAPI_BASE_URL}/event/unregister_event", 